@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+Generate a synthetic data directory in the layout of assets/data/
+
+Writes one wide TSV (a DATE header row of dates, one row per fraction) and
+its _std file per layout entry, plus a layout.json referencing them.
+
+    python generate_data.py OUTDIR [--years 10] [--entries 100] [--fractions 3] [--missing 0.6]
+"""
+import os
+import json
+import argparse
+
+import numpy as np
+import pandas as pd
+
+PATHOGENS = ['SARS-CoV-2', 'Norovirus', 'Influenza A', 'Influenza B', 'H5N1', 'Measles', 'RSV']
+
+
+def synthetic_series(dates, n_fractions, missing, rng):
+    """
+    Seasonal log-normal concentrations with a fraction of the samples missing
+    """
+    t = np.arange(len(dates)) / 365.0
+    rows = {}
+    for i in range(n_fractions):
+        season = np.sin(2 * np.pi * (t + rng.random()))
+        values = np.exp(13 + 2 * season + rng.normal(0, 0.5, len(dates)))
+        values[rng.random(len(dates)) < missing] = np.nan
+        rows[f"F{i + 1}"] = values
+    return pd.DataFrame(rows, index=dates).T
+
+
+def write_wide(df, path):
+    out = df.copy()
+    out.columns = [f"{d.month}/{d.day}/{d.year}" for d in out.columns]
+    out.index.name = 'DATE'
+    out.to_csv(path, sep='\t', float_format='%.6g')
+
+
+def generate(outdir, years=10, entries=100, fractions=3, missing=0.6, seed=0):
+    rng = np.random.default_rng(seed)
+    data_dir = os.path.join(outdir, 'assets', 'data')
+    os.makedirs(data_dir, exist_ok=True)
+    dates = pd.date_range(end='2025-10-23', periods=int(years * 365), freq='D')
+
+    layout = []
+    for idx in range(entries):
+        pathogen = PATHOGENS[idx % len(PATHOGENS)]
+        data_tsv = f"assets/data/SYN{idx + 1}-qPCR-Daily_Trend.tsv"
+        std_tsv = f"assets/data/SYN{idx + 1}-qPCR-Daily_Trend_std.tsv"
+        values = synthetic_series(dates, fractions, missing, rng)
+        write_wide(values, os.path.join(outdir, data_tsv))
+        write_wide(values * rng.uniform(0.05, 0.3, values.shape), os.path.join(outdir, std_tsv))
+
+        config = {
+            "title": f"Synthetic {pathogen} series {idx + 1}",
+            "description": "Synthetic benchmark data.",
+            "plot_data_tsv": data_tsv,
+            "plot_std_tsv": std_tsv,
+            "plot_title": f"Synthetic {pathogen} series {idx + 1}",
+            "plot_xaxis_title": "Date",
+            "plot_yaxis_title": f"{pathogen} Virions / L",
+            "pathogen": pathogen,
+        }
+        if idx < len(PATHOGENS):
+            config["analysis"] = {
+                "trend": "stable",
+                "description": "Synthetic trend analysis.",
+                "figure": "assets/data/images/synthetic.png",
+            }
+        layout.append(config)
+
+    with open(os.path.join(data_dir, 'layout.json'), 'w') as f:
+        json.dump(layout, f, indent=4)
+    return layout
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic wastewater qPCR data")
+    parser.add_argument('outdir', help="output directory (assets/data/ is created in it)")
+    parser.add_argument('--years', type=float, default=10, help="years of daily samples")
+    parser.add_argument('--entries', type=int, default=100, help="number of layout entries")
+    parser.add_argument('--fractions', type=int, default=3, help="fractions per entry")
+    parser.add_argument('--missing', type=float, default=0.6, help="share of missing samples")
+    parser.add_argument('--seed', type=int, default=0, help="random seed")
+    args = parser.parse_args()
+    generate(args.outdir, args.years, args.entries, args.fractions, args.missing, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+"""
+Benchmark the dashboard on synthetic data
+
+Generates a synthetic data directory (see generate_data.py), then runs the
+app in fresh interpreters (cold and warm parse cache) measuring import and
+startup time, peak RSS, per-callback latency through the Flask test client
+and figure JSON sizes. Results are written as JSON so runs from different
+commits can be compared:
+
+    python run_benchmarks.py [--years 10] [--entries 100] [--output results.json]
+    python run_benchmarks.py --compare old.json new.json
+
+With --startup-budget SECONDS the run fails (exit code 1) when the warm
+startup takes longer, or when a module that must load on first use only
+(LAZY_MODULES) is imported at startup.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import statistics
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'wastewater_qpcr_app')
+
+# Slow imports the app only loads on first use
+LAZY_MODULES = ['openai', 'httpx', 'plotly.express', 'scipy.stats', 'pymannkendall']
+
+
+def timings(func, repeat):
+    """
+    Run func() repeat times, returns latency statistics in milliseconds
+    """
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        'median_ms': statistics.median(samples),
+        'p95_ms': samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        'max_ms': samples[-1],
+    }
+
+
+def find_dependency(dependencies, output):
+    for dep in dependencies:
+        if output in dep['output'] and not dep.get('clientside_function'):
+            return dep
+    raise KeyError(f"No callback with output {output}")
+
+
+def call_callback(client, dep, values, headers=None):
+    """
+    POST a callback request the way the Dash renderer does, values maps
+    'id.property' of the inputs and states to their values
+    """
+    output = dep['output']
+    if output.startswith('..'):
+        outputs = [dict(zip(('id', 'property'), o.rsplit('.', 1))) for o in output[2:-2].split('...')]
+    else:
+        outputs = dict(zip(('id', 'property'), output.rsplit('.', 1)))
+
+    def props(items):
+        return [{'id': i['id'], 'property': i['property'], 'value': values.get(f"{i['id']}.{i['property']}")}
+                for i in items]
+
+    body = {
+        'output': output,
+        'outputs': outputs,
+        'inputs': props(dep['inputs']),
+        'state': props(dep['state']),
+        'changedPropIds': [f"{i['id']}.{i['property']}" for i in dep['inputs']],
+    }
+    response = client.post('/_dash-update-component', json=body, headers=headers)
+    if response.status_code not in (200, 204):
+        raise RuntimeError(f"Callback {output} failed with {response.status_code}: {response.data[:200]}")
+    return response
+
+
+def child(repeat):
+    """
+    Run in a fresh interpreter with the synthetic data directory as cwd
+    """
+    import resource
+    import logging
+
+    sys.path.insert(0, APP_DIR)
+    results = {}
+
+    start = time.perf_counter()
+    import app
+    from data_store import process_data
+    results['startup_s'] = time.perf_counter() - start
+    results['eager_imports'] = [name for name in LAZY_MODULES if name in sys.modules]
+    results['startup_peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    logging.getLogger().setLevel(logging.WARNING)
+
+    page = sys.modules['pages.wastewater_qpcr_app']
+    store = page.store
+    results['entries_loaded'] = len(store.data_frames)
+    results['rows'] = int(sum(len(df) for df in store.data_frames.values()))
+    results['data_memory_mb'] = sum(store.memory_usage().values()) / 2**20
+
+    # figure payloads
+    sizes = [len(page.figure_cache.get_json(idx, *reversed(store.get(idx)))) for idx in page.chart_indexes]
+    results['figure_json_total_kb'] = sum(sizes) / 1024
+    results['figure_json_max_kb'] = max(sizes, default=0) / 1024
+
+    # data processing and summary preparation
+    config = page.layout_config[page.chart_indexes[0]]
+    results['process_data'] = timings(lambda: process_data(config['plot_data_tsv'], config.get('plot_std_tsv')), repeat)
+    results['compute_stats'] = timings(lambda: page.series_stats.compute_stats(store.data_frames), repeat)
+    results['detect_events'] = timings(lambda: page.detect_events(store.data_frames, store.derived), repeat)
+    results['build_matrix'] = timings(lambda: page.compare.build_matrix(store.data_frames), repeat)
+    matrix = page.compare.build_matrix(store.data_frames)
+    results['lag_table'] = timings(lambda: page.compare.lag_table(matrix), repeat)
+    results['build_summary_text'] = timings(lambda: page.build_summary_text(page.get_stats(), 'all pathogens',
+                                                                            page.get_events(), store.derived), repeat)
+
+    # callbacks through the Flask test client
+    client = app.server.test_client()
+    dependencies = client.get('/_dash-dependencies').get_json()
+    first = page.chart_indexes[0] + 1
+    versions = store.versions()
+    callbacks = {
+        'page_layout': ('_pages_content.children', {'_pages_location.pathname': '/', '_pages_location.search': ''}),
+        'update_time': ('update-time-id.children', {'pathogen-menu-id.value': 'all pathogens'}),
+        'refresh_figures_unchanged': ('data-version-id.data', {'data-refresh-interval.n_intervals': 1,
+                                                               'data-version-id.data': versions}),
+        'refresh_figures_all': ('data-version-id.data', {'data-refresh-interval.n_intervals': 1,
+                                                         'data-version-id.data': {}}),
+        'zoom_chart': (f'chart{first}-graph-id.figure@', {f'chart{first}-graph-id.relayoutData': {
+            'xaxis.range[0]': '2024-01-01', 'xaxis.range[1]': '2024-03-01'}}),
+    }
+    results['callbacks'] = {}
+    for name, (output, values) in callbacks.items():
+        dep = find_dependency(dependencies, output)
+        response = call_callback(client, dep, values)
+        stats = timings(lambda: call_callback(client, dep, values), repeat)
+        stats['response_kb'] = len(response.data) / 1024
+        # size on the wire for a browser accepting compressed responses
+        compressed = call_callback(client, dep, values, headers={'Accept-Encoding': 'gzip, br'})
+        stats['response_wire_kb'] = len(compressed.data) / 1024
+        results['callbacks'][name] = stats
+
+    results['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps(results))
+
+
+def run_child(data_dir, cache_dir, repeat):
+    env = dict(os.environ, WW_PARSE_CACHE_DIR=cache_dir)
+    env.pop('WW_SHARED_STORE_DIR', None)
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', '--repeat', str(repeat)],
+        cwd=data_dir, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+    )
+    wall = time.perf_counter() - start
+    if proc.returncode:
+        sys.stderr.write(proc.stderr[-4000:])
+        raise RuntimeError(f"Benchmark process failed with exit code {proc.returncode}")
+    results = json.loads(proc.stdout.strip().splitlines()[-1])
+    results['process_wall_s'] = wall
+    return results
+
+
+def check_startup(results, budget):
+    """
+    Startup budget violations of the warm run
+    """
+    warm = results['warm']
+    errors = []
+    if warm['startup_s'] > budget:
+        errors.append(f"warm startup took {warm['startup_s']:.2f}s, the budget is {budget:.2f}s")
+    if warm['eager_imports']:
+        errors.append(f"imported at startup: {', '.join(warm['eager_imports'])}")
+    return errors
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=BENCH_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def flatten(results, prefix=''):
+    out = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            out.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)):
+            out[f"{prefix}{key}"] = value
+    return out
+
+
+def compare(old_file, new_file):
+    with open(old_file) as f:
+        old = flatten(json.load(f)['results'])
+    with open(new_file) as f:
+        new = flatten(json.load(f)['results'])
+    print(f"{'metric':60s} {'old':>12s} {'new':>12s} {'change':>8s}")
+    for key in sorted(set(old) & set(new)):
+        change = (new[key] - old[key]) / old[key] * 100 if old[key] else 0
+        print(f"{key:60s} {old[key]:12.3f} {new[key]:12.3f} {change:+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard on synthetic data")
+    parser.add_argument('--years', type=float, default=10, help="years of daily samples")
+    parser.add_argument('--entries', type=int, default=100, help="number of layout entries")
+    parser.add_argument('--fractions', type=int, default=3, help="fractions per entry")
+    parser.add_argument('--missing', type=float, default=0.6, help="share of missing samples")
+    parser.add_argument('--repeat', type=int, default=5, help="repetitions of each timed call")
+    parser.add_argument('--data-dir', help="reuse a generated data directory instead of a temporary one")
+    parser.add_argument('--output', default='bench_results.json', help="results file")
+    parser.add_argument('--startup-budget', type=float, metavar='SECONDS',
+                        help="fail if the warm startup takes longer or imports LAZY_MODULES")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="compare two results files")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return child(args.repeat)
+    if args.compare:
+        return compare(*args.compare)
+
+    sys.path.insert(0, BENCH_DIR)
+    from generate_data import generate
+
+    tmp_dir = tempfile.mkdtemp(prefix='ww_bench_')
+    try:
+        data_dir = args.data_dir or os.path.join(tmp_dir, 'data')
+        if not os.path.exists(os.path.join(data_dir, 'assets', 'data', 'layout.json')):
+            start = time.perf_counter()
+            generate(data_dir, args.years, args.entries, args.fractions, args.missing)
+            print(f"Generated synthetic data in {time.perf_counter() - start:.1f}s")
+
+        cache_dir = os.path.join(tmp_dir, 'parse_cache')
+        results = {
+            'cold': run_child(data_dir, cache_dir, args.repeat),
+            'warm': run_child(data_dir, cache_dir, args.repeat),
+        }
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'params': {k: getattr(args, k) for k in ('years', 'entries', 'fractions', 'missing', 'repeat')},
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for phase, res in results.items():
+        print(f"{phase}: startup {res['startup_s']:.2f}s, peak RSS {res['peak_rss_mb']:.0f} MB, "
+              f"figures {res['figure_json_total_kb']:.0f} KB, page layout "
+              f"{res['callbacks']['page_layout']['median_ms']:.1f} ms")
+    print(f"Results written to {args.output}")
+
+    if args.startup_budget is not None:
+        errors = check_startup(results, args.startup_budget)
+        for error in errors:
+            print(f"Startup budget exceeded: {error}", file=sys.stderr)
+        if errors:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
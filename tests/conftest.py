@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'wastewater_qpcr_app')
+
+# the app modules import each other as top-level modules
+sys.path.insert(0, APP_DIR)
+
+
+@pytest.fixture
+def app_dir(monkeypatch):
+    # layout.json and the data files are referenced relative to the app directory
+    monkeypatch.chdir(APP_DIR)
+    return APP_DIR
@@ -0,0 +1,34 @@
+"""
+Validation of appended rows
+"""
+import pandas as pd
+import pytest
+
+import ingest
+
+
+def series_frame():
+    return pd.DataFrame({
+        'Date': pd.to_datetime(['2025-01-01', '2025-01-01', '2025-01-08']),
+        'Fraction': pd.Categorical(['F1', 'F3', 'F1'], categories=['F1', 'F3']),
+        'Value': [1.0, 2.0, 3.0],
+    })
+
+
+def rows(*items):
+    return ingest.parse_rows([{'date': date, 'fraction': fraction, 'value': 1.0} for date, fraction in items])
+
+
+def test_accepts_newer_rows_of_existing_fractions():
+    ingest.check_append(series_frame(), rows(('2025-01-09', 'F1'), ('2025-01-02', 'F3')))
+
+
+def test_rejects_stale_rows():
+    with pytest.raises(ValueError, match="not newer"):
+        ingest.check_append(series_frame(), rows(('2025-01-08', 'F1')))
+
+
+def test_rejects_unknown_fractions():
+    # a new fraction would add a trace, which appended points cannot express
+    with pytest.raises(ValueError, match="Unknown fractions"):
+        ingest.check_append(series_frame(), rows(('2025-01-09', 'F9')))
@@ -0,0 +1,23 @@
+"""
+Frames read back from the parse cache are those process_data() returned
+"""
+import pandas as pd
+
+import parse_cache
+from data_store import process_data
+
+DATA_FILE = 'assets/data/LIVE-qPCR-Daily_Trend.tsv'
+STD_FILE = 'assets/data/LIVE-qPCR-Daily_Trend_std.tsv'
+
+
+def test_round_trip_keeps_dtypes(app_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(parse_cache, 'cache_dir', str(tmp_path))
+    files = [DATA_FILE, STD_FILE]
+    df = process_data(*files)
+    parse_cache.save(files, df)
+    cached = parse_cache.load(files)
+
+    # the fractions stay categorical, with the same categories
+    assert isinstance(cached['Fraction'].dtype, pd.CategoricalDtype)
+    pd.testing.assert_frame_equal(cached, df)
+    assert cached.memory_usage(deep=True).sum() == df.memory_usage(deep=True).sum()
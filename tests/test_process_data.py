@@ -0,0 +1,64 @@
+"""
+process_data() against the long format of the original unstack/merge
+implementation, on the bundled TSVs
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import sites
+from conftest import APP_DIR
+from data_store import process_data
+
+_, LAYOUT = sites.load_layout(os.path.join(APP_DIR, 'assets/data/layout.json'))
+ENTRIES = [(config['plot_data_tsv'], config.get('plot_std_tsv')) for config in LAYOUT if 'plot_data_tsv' in config]
+
+
+def legacy_long(path):
+    # the unstack of the original process_data, dates as '%Y-%m-%d' strings
+    df = pd.read_csv(path, sep='\t')
+    df = df.set_index('DATE').unstack().reset_index().rename(
+        columns={'DATE': 'Fraction', 'level_0': 'Date', 0: 'Value'}
+    )
+    df['Date'] = pd.to_datetime(df['Date'], format='mixed', errors='coerce').dt.strftime('%Y-%m-%d')
+    return df[df['Date'].notnull()].reset_index(drop=True)
+
+
+def legacy_process_data(data_file, std_file=None):
+    """
+    The original implementation, with the two intended changes applied:
+    cells that are not numbers (e.g. '#VALUE!') are missing, and missing
+    cells are dropped (values) or NaN (std) instead of zero-filled
+    """
+    df = legacy_long(data_file)
+    if std_file and os.path.exists(std_file):
+        df = df.merge(legacy_long(std_file), on=['Date', 'Fraction'], how='left', suffixes=('', '_std'))
+    for col in ('Value', 'Value_std'):
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+    return df[df['Value'].notna()].reset_index(drop=True)
+
+
+@pytest.mark.parametrize('data_file,std_file', ENTRIES, ids=[os.path.basename(f) for f, _ in ENTRIES])
+def test_matches_legacy_long_format(app_dir, data_file, std_file):
+    if not os.path.exists(data_file):
+        pytest.skip(f"{data_file} is not bundled")
+    df = process_data(data_file, std_file)
+    expected = legacy_process_data(data_file, std_file)
+
+    assert list(df.columns) == list(expected.columns)
+    assert df['Date'].dtype.kind == 'M'
+    assert isinstance(df['Fraction'].dtype, pd.CategoricalDtype)
+    assert df['Value'].dtype == np.float64
+    if 'Value_std' in df.columns:
+        assert df['Value_std'].dtype == np.float64
+
+    # same rows in the same order (date-major, fraction-minor)
+    assert len(df) == len(expected)
+    np.testing.assert_array_equal(df['Date'].dt.strftime('%Y-%m-%d').to_numpy(), expected['Date'].to_numpy())
+    np.testing.assert_array_equal(df['Fraction'].astype(str).to_numpy(), expected['Fraction'].astype(str).to_numpy())
+    np.testing.assert_array_equal(df['Value'].to_numpy(), expected['Value'].to_numpy())
+    if 'Value_std' in df.columns:
+        np.testing.assert_array_equal(df['Value_std'].to_numpy(), expected['Value_std'].to_numpy())
@@ -0,0 +1,44 @@
+"""
+Importing the app must not load the modules it only needs on first use, and
+must fit in the startup budget
+"""
+import os
+import sys
+import json
+import subprocess
+
+from conftest import APP_DIR
+
+sys.path.insert(0, os.path.join(os.path.dirname(APP_DIR), 'benchmarks'))
+from run_benchmarks import LAZY_MODULES
+
+# Seconds the import of the app may take with a warm parse cache
+STARTUP_BUDGET = float(os.environ.get('WW_STARTUP_BUDGET', 5))
+
+
+def import_app(tmp_path):
+    """
+    Import the app in a fresh interpreter, return the import time in
+    seconds and the lazy modules it loaded
+    """
+    code = ("import sys, json, time; start = time.perf_counter(); import app; "
+            "seconds = time.perf_counter() - start; "
+            f"print(json.dumps([seconds, [name for name in {LAZY_MODULES!r} if name in sys.modules]]))")
+    env = dict(os.environ, PYTHONPATH=APP_DIR, WW_PARSE_CACHE_DIR=str(tmp_path / 'parse'),
+               WW_WARM_CACHES='0')
+    result = subprocess.run([sys.executable, '-c', code], cwd=APP_DIR, env=env,
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr[-2000:]
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_app_import_is_lazy(tmp_path):
+    _, eager = import_app(tmp_path)
+    assert eager == []
+
+
+def test_app_import_fits_budget(tmp_path):
+    # the first import fills the parse cache, the second one is a regular start
+    import_app(tmp_path)
+    seconds, _ = import_app(tmp_path)
+    assert seconds <= STARTUP_BUDGET, f"importing the app took {seconds:.2f}s, the budget is {STARTUP_BUDGET:.2f}s"
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+"""
+Spikes and new detections of every series and fraction, computed at once.
+
+Each sample is compared with a baseline of the BASELINE_SAMPLES samples of
+its fraction before it: the robust z-score is the deviation of log(1 + value)
+from the baseline median in units of the scaled median absolute deviation
+(floored at MIN_SCALE so that a flat baseline does not make every change a
+spike). A sample with z >= Z_THRESHOLD over a baseline median above zero
+is a 'spike'. A sample above zero
+after at least MIN_NONDETECT_RUN zero samples (non-detects) is a
+'new_detection'.
+
+Only the events of the last EVENT_DAYS days of each series are kept, so the
+table stays small; the events of the last ALERT_DAYS days are the alerts of
+the sidebar and the AI summary prompt.
+"""
+import numpy as np
+import pandas as pd
+
+# Samples before each one forming its baseline, and the fewest that make one
+BASELINE_SAMPLES = 8
+MIN_BASELINE = 4
+
+# Robust z-score of a spike, and the smallest baseline spread (in log units)
+Z_THRESHOLD = 3.5
+MIN_SCALE = 0.1
+
+# Non-detects in a row before a detection counts as new
+MIN_NONDETECT_RUN = 3
+
+# Events kept (days before the latest date of each series), and the recent ones
+EVENT_DAYS = 90
+ALERT_DAYS = 14
+
+# Scale of the median absolute deviation to the std of normal samples
+MAD_SCALE = 1.4826
+
+EVENT_COLUMNS = ['series', 'Fraction', 'Date', 'age_days', 'event', 'value', 'baseline', 'z', 'nondetect_run']
+
+EVENT_LABELS = {'spike': "spike", 'new_detection': "new detection"}
+
+
+def _baseline(y, group_start, positions):
+    """
+    Median and MAD of the BASELINE_SAMPLES values before each of the positions
+    within its group, NaN where fewer than MIN_BASELINE are available
+    """
+    group_start = group_start[positions]
+    previous = positions[:, None] - np.arange(1, BASELINE_SAMPLES + 1)[None, :]
+    valid = previous >= group_start[:, None]
+    windows = np.where(valid, y[np.maximum(previous, 0)], np.nan)
+    enough = valid.sum(axis=1) >= MIN_BASELINE
+    median = np.full(len(positions), np.nan)
+    mad = np.full(len(positions), np.nan)
+    if enough.any():
+        median[enough] = np.nanmedian(windows[enough], axis=1)
+        mad[enough] = np.nanmedian(np.abs(windows[enough] - median[enough, None]), axis=1)
+    return median, mad
+
+
+def _nondetect_run(detected, group_start):
+    """
+    Number of non-detects in a row right before each position within its group
+    """
+    positions = np.arange(len(detected))
+    last_detect = np.maximum.accumulate(np.where(detected, positions, -1))
+    before = np.concatenate([[-1], last_detect[:-1]])
+    return positions - np.maximum(before, group_start - 1) - 1
+
+
+def detect_events(data_frames):
+    """
+    Event table of all series: one row per spike or new detection in the
+    last EVENT_DAYS days of each series, with its age in days before the
+    series' latest date, the value, the baseline (median of the previous
+    samples), the robust z-score and the number of non-detects before it.
+    """
+    frames = [df[['Date', 'Fraction', 'Value']].assign(series=idx) for idx, df in data_frames.items() if len(df)]
+    if not frames:
+        return pd.DataFrame(columns=EVENT_COLUMNS)
+
+    df = pd.concat(frames, ignore_index=True)
+    df['Fraction'] = df['Fraction'].astype(str)
+    df = df[df['Value'].notna()].sort_values(['series', 'Fraction', 'Date'], kind='stable', ignore_index=True)
+
+    keys = df[['series', 'Fraction']]
+    new_group = (keys != keys.shift()).any(axis=1).to_numpy()
+    positions = np.arange(len(df))
+    group_start = np.maximum.accumulate(np.where(new_group, positions, 0))
+
+    values = df['Value'].to_numpy(dtype='float64')
+    detected = values > 0
+    run = _nondetect_run(detected, group_start)
+
+    # baselines are only needed for the samples of the event window
+    age = ((df.groupby('series')['Date'].transform('max') - df['Date']) / pd.Timedelta(days=1)).to_numpy()
+    recent = np.flatnonzero(age <= EVENT_DAYS)
+    y = np.log1p(np.clip(values, 0, None))
+    median, mad = _baseline(y, group_start, recent)
+    with np.errstate(invalid='ignore'):
+        z = (y[recent] - median) / np.maximum(mad * MAD_SCALE, MIN_SCALE)
+
+    new_detection = detected[recent] & (run[recent] >= MIN_NONDETECT_RUN)
+    events = df.iloc[recent].assign(age_days=age[recent].astype(int), baseline=np.expm1(median), z=z,
+                                    nondetect_run=run[recent],
+                                    event=np.where(new_detection, 'new_detection', 'spike'))
+    # rises from a baseline of non-detects are new detections, not spikes
+    spike = (z >= Z_THRESHOLD) & (median > 0)
+    events = events[new_detection | spike].rename(columns={'Value': 'value'})
+    return events.sort_values(['series', 'Date', 'Fraction'], ignore_index=True)[EVENT_COLUMNS]
+
+
+def series_events(table, idx, days=None):
+    """
+    Events of one series, only those of its last `days` days if given
+    """
+    rows = table[table['series'] == idx]
+    if days is not None:
+        rows = rows[rows['age_days'] <= days]
+    return rows
+
+
+def describe(row, units=''):
+    """
+    One-line description of an event, e.g. for the AI summary prompt
+    """
+    text = f"{row.Fraction} {row.Date:%Y-%m-%d}: {EVENT_LABELS[row.event]}, value {row.value:.4g}{units}"
+    if row.event == 'new_detection':
+        return text + f" after {row.nondetect_run} non-detects"
+    return text + f", baseline {row.baseline:.4g} (robust z {row.z:.1f})"
@@ -2,6 +2,8 @@ import dash
 from dash import Dash, html, dcc
 import dash_bootstrap_components as dbc
 
+import payload
+
 # External stylesheets
 external_stylesheets = [
     dbc.themes.BOOTSTRAP, 
@@ -20,6 +22,9 @@ app = dash.Dash(__name__,
 app.title = "Wastewater qPCR"
 server = app.server
 
+# ETags and gzip/brotli compression of responses
+payload.init_app(server)
+
 if __name__ == '__main__':
     # Disable debug mode to avoid pkgutil.find_loader error in Python 3.14+
     app.run(debug=False, port=8765)
\ No newline at end of file
@@ -0,0 +1,192 @@
+// Clientside callbacks of the wastewater qPCR page
+
+const TYPED_ARRAYS = {
+    f8: Float64Array, f4: Float32Array,
+    i1: Int8Array, i2: Int16Array, i4: Int32Array,
+    u1: Uint8Array, u2: Uint16Array, u4: Uint32Array
+};
+
+// Plain array of figure values, which plotly may encode as {dtype, bdata}
+function toArray(values) {
+    if (values && values.bdata !== undefined) {
+        const bytes = Uint8Array.from(atob(values.bdata), function(c) { return c.charCodeAt(0); });
+        return Array.from(new TYPED_ARRAYS[values.dtype](bytes.buffer));
+    }
+    return values ? Array.from(values) : [];
+}
+
+// Charts start with a placeholder figure and fetch their figure (data-figure-src)
+// when they come near the viewport or their pathogen is selected. At most
+// MAX_FETCHES figures are fetched at a time, the charts on screen first.
+const chartLoader = {
+    MAX_FETCHES: 2,
+    queue: new Set(),
+    requested: new WeakSet(),
+    fetching: 0,
+    observer: null,
+
+    onScreen: function(el) {
+        if (el.offsetParent === null) {
+            return false;
+        }
+        const rect = el.getBoundingClientRect();
+        return rect.bottom > 0 && rect.top < window.innerHeight;
+    },
+
+    observe: function() {
+        if (!this.observer) {
+            this.observer = new IntersectionObserver(function(entries) {
+                entries.forEach(function(entry) {
+                    if (entry.isIntersecting) {
+                        chartLoader.request(entry.target);
+                    }
+                });
+            }, {rootMargin: '200px'});
+        }
+        document.querySelectorAll('[data-figure-src]').forEach(function(el) {
+            if (!chartLoader.requested.has(el)) {
+                chartLoader.observer.observe(el);
+            }
+        });
+    },
+
+    request: function(el) {
+        if (this.requested.has(el)) {
+            return;
+        }
+        this.queue.add(el);
+        // let the renderer apply pending style changes before picking the next chart
+        setTimeout(function() { chartLoader.next(); }, 0);
+    },
+
+    next: function() {
+        while (this.fetching < this.MAX_FETCHES && this.queue.size) {
+            // on screen first, top to bottom, then in the order requested
+            const queued = Array.from(this.queue);
+            const visible = queued.filter(this.onScreen).sort(function(a, b) {
+                return a.getBoundingClientRect().top - b.getBoundingClientRect().top;
+            });
+            this.load(visible.length ? visible[0] : queued[0]);
+        }
+    },
+
+    load: function(el) {
+        this.queue.delete(el);
+        this.requested.add(el);
+        this.observer.unobserve(el);
+        this.fetching++;
+        fetch(el.dataset.figureSrc).then(function(response) {
+            if (!response.ok) {
+                throw new Error(response.status + ' ' + response.statusText);
+            }
+            return response.json();
+        }).then(function(figure) {
+            window.dash_clientside.set_props(el.dataset.graphId, {figure: figure});
+        }).catch(function(error) {
+            // fetched again when it comes back into view
+            console.error('Failed to load ' + el.dataset.figureSrc, error);
+            chartLoader.requested.delete(el);
+            chartLoader.observer.observe(el);
+        }).finally(function() {
+            chartLoader.fetching--;
+            chartLoader.next();
+        });
+    }
+};
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    wastewater: {
+        // Show the trend cards and chart blocks of the selected pathogen.
+        // blockPathogens lists the pathogen of each output, in output order,
+        // and the current styles follow as the remaining arguments.
+        filter_pathogen: function(pathogen, blockPathogens, ...styles) {
+            const showAll = !pathogen || pathogen === 'all pathogens';
+            if (!showAll) {
+                // the charts of the selected pathogen are fetched even when off screen
+                document.querySelectorAll('[data-figure-src]').forEach(function(el) {
+                    if (el.dataset.pathogen === pathogen) {
+                        chartLoader.request(el);
+                    }
+                });
+            }
+            return blockPathogens.map(function(blockPathogen, i) {
+                const display = (showAll || blockPathogen === pathogen) ? 'block' : 'none';
+                return Object.assign({}, styles[i], {display: display});
+            });
+        },
+
+        // Observe the chart blocks of the page to fetch their figures in view
+        observe_charts: function(blockPathogens) {
+            setTimeout(function() { chartLoader.observe(); }, 0);
+            return window.dash_clientside.no_update;
+        },
+
+        // Fetch the images of the trend cards one after the other once the page
+        // is idle, the variants the modal picks for this screen, so that it
+        // opens without waiting. Skipped when the browser asks to save data.
+        preload_images: function(sources) {
+            const connection = navigator.connection;
+            if (!sources || !sources.length || (connection && connection.saveData)) {
+                return window.dash_clientside.no_update;
+            }
+            const idle = window.requestIdleCallback || function(f) { return setTimeout(f, 1000); };
+            idle(function() {
+                const webp = document.createElement('canvas').toDataURL('image/webp').startsWith('data:image/webp');
+                const next = function(i) {
+                    if (i >= sources.length) {
+                        return;
+                    }
+                    const img = new Image();
+                    img.onload = img.onerror = function() { next(i + 1); };
+                    img.sizes = sources[i].sizes;
+                    img.srcset = webp ? sources[i].webp : sources[i].png;
+                    img.src = sources[i].src;
+                };
+                next(0);
+            });
+            return window.dash_clientside.no_update;
+        },
+
+        // Add the points appended since the figures were sent. appended maps the
+        // position of a chart to a list of {trace, x, y, error_y} extensions,
+        // the current figures follow as the remaining arguments. Charts still
+        // showing their placeholder are skipped, and points a lazily fetched
+        // figure already has (not newer than its last date) are not added again.
+        extend_figures: function(appended, ...figures) {
+            const no_update = window.dash_clientside.no_update;
+            return figures.map(function(figure, i) {
+                const traces = appended && appended[i];
+                if (!traces || !figure) {
+                    return no_update;
+                }
+                const data = figure.data.slice();
+                traces.forEach(function(ext) {
+                    if (!data[ext.trace]) {
+                        return;
+                    }
+                    const trace = Object.assign({}, data[ext.trace]);
+                    const x = toArray(trace.x);
+                    const last = x.length ? x[x.length - 1] : -Infinity;
+                    const start = ext.x.findIndex(function(value) { return value > last; });
+                    if (start < 0) {
+                        return;
+                    }
+                    trace.x = x.concat(ext.x.slice(start));
+                    trace.y = toArray(trace.y).concat(ext.y.slice(start));
+                    if (ext.error_y && trace.error_y) {
+                        trace.error_y = Object.assign({}, trace.error_y, {
+                            array: toArray(trace.error_y.array).concat(ext.error_y.slice(start))
+                        });
+                    }
+                    data[ext.trace] = trace;
+                });
+                return Object.assign({}, figure, {data: data});
+            });
+        },
+
+        // Toggle the navbar collapse on small screens
+        toggle_navbar_collapse: function(n, is_open) {
+            return n ? !is_open : is_open;
+        }
+    }
+});
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+"""
+Cross-pathogen comparison of the series on one time axis.
+
+build_matrix() aligns the values of every (series, fraction) of the data on
+the union of their sample dates: one float64 frame, dates x columns, NaN
+where a column has no sample on a date. It is built once per data version and
+shared by the comparison chart and the lag correlations, so a request only
+selects columns of it.
+
+A column is shown either normalized (percent of its maximum) or as is on a
+log axis. lag_table() correlates every pair of columns on weekly means of
+log(1 + value), shifting one of them by up to MAX_LAG_WEEKS weeks; a positive
+lag means that the second column follows the first one.
+"""
+import numpy as np
+import pandas as pd
+
+SCALES = {'normalized': "Percent of maximum", 'log': "Log scale"}
+
+# Weeks a column is shifted by at most, and the fewest overlapping weeks of a correlation
+MAX_LAG_WEEKS = 8
+MIN_OVERLAP_WEEKS = 12
+
+LAG_COLUMNS = ['series_a', 'fraction_a', 'series_b', 'fraction_b', 'corr', 'weeks', 'best_lag_weeks',
+               'best_corr', 'best_weeks']
+
+
+def build_matrix(data_frames):
+    """
+    Date-indexed matrix of all series, one column per (series, fraction),
+    the mean value of a column's samples of each date
+    """
+    frames = [df[['Date', 'Fraction', 'Value']].assign(series=idx) for idx, df in data_frames.items() if len(df)]
+    if not frames:
+        return pd.DataFrame(index=pd.DatetimeIndex([], name='Date'),
+                            columns=pd.MultiIndex.from_tuples([], names=['series', 'Fraction']), dtype='float64')
+    df = pd.concat(frames, ignore_index=True)
+    df['Fraction'] = df['Fraction'].astype(str)
+    matrix = df.groupby(['Date', 'series', 'Fraction'])['Value'].mean().unstack(['series', 'Fraction'])
+    return matrix.sort_index(axis=1).astype('float64')
+
+
+def column_key(idx, fraction):
+    return f"{idx}|{fraction}"
+
+
+def parse_key(key):
+    idx, fraction = key.split('|', 1)
+    return int(idx), fraction
+
+
+def select(matrix, keys):
+    """
+    Columns of the matrix given as column keys, unknown ones are skipped,
+    without the dates none of them has a value on
+    """
+    columns = [parse_key(key) for key in keys]
+    columns = [column for column in columns if column in matrix.columns]
+    return matrix[columns].dropna(how='all')
+
+
+def scale(values, how):
+    """
+    Values of the matrix columns for display: percent of each column's
+    maximum, or the positive values only for a log axis
+    """
+    if how == 'normalized':
+        peak = values.max()
+        return values.div(peak.where(peak > 0)) * 100
+    return values.where(values > 0)
+
+
+def weekly_log(matrix):
+    """
+    Weekly means of log(1 + value) of the matrix columns
+    """
+    return np.log1p(matrix.clip(lower=0)).resample('W').mean()
+
+
+def _masked_corr(a, b):
+    """
+    Pearson correlations of every column of a with every column of b over
+    the rows where both have a value, and the number of those rows
+    """
+    ma, mb = ~np.isnan(a), ~np.isnan(b)
+    a0, b0 = np.where(ma, a, 0.0), np.where(mb, b, 0.0)
+    ma, mb = ma.astype('float64'), mb.astype('float64')
+    n = ma.T @ mb
+    sum_a, sum_b = a0.T @ mb, ma.T @ b0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = a0.T @ b0 - sum_a * sum_b / n
+        var_a = (a0 ** 2).T @ mb - sum_a ** 2 / n
+        var_b = ma.T @ (b0 ** 2) - sum_b ** 2 / n
+        corr = cov / np.sqrt(var_a * var_b)
+    corr[(n < MIN_OVERLAP_WEEKS) | ~np.isfinite(corr)] = np.nan
+    return np.clip(corr, -1, 1), n.astype(int)
+
+
+def lag_table(matrix):
+    """
+    One row per pair of matrix columns: the correlation at lag 0, and the
+    lag (in weeks, the second column following the first for a positive
+    lag) with the highest correlation, each with its overlapping weeks
+    """
+    weekly = weekly_log(matrix)
+    values = weekly.to_numpy(dtype='float64')
+    k = values.shape[1]
+    lags = range(-MAX_LAG_WEEKS, MAX_LAG_WEEKS + 1)
+    corr = np.full((len(lags), k, k), np.nan)
+    weeks = np.zeros((len(lags), k, k), dtype=int)
+    for i, lag in enumerate(lags):
+        if abs(lag) >= len(values):
+            continue
+        # row t of a against row t + lag of b
+        a = values[:len(values) - lag] if lag >= 0 else values[-lag:]
+        b = values[lag:] if lag >= 0 else values[:len(values) + lag]
+        corr[i], weeks[i] = _masked_corr(a, b)
+
+    rows = []
+    zero = MAX_LAG_WEEKS
+    for a in range(k):
+        for b in range(a + 1, k):
+            pair = corr[:, a, b]
+            if np.isfinite(pair).any():
+                best = int(np.nanargmax(pair))
+                best_values = (lags[best], pair[best], weeks[best, a, b])
+            else:
+                best_values = (None, np.nan, 0)
+            rows.append((*weekly.columns[a], *weekly.columns[b], pair[zero], weeks[zero, a, b], *best_values))
+    return pd.DataFrame(rows, columns=LAG_COLUMNS)
+
+
+def pair_rows(table, keys):
+    """
+    Rows of the lag table between the given columns (column keys)
+    """
+    columns = {parse_key(key) for key in keys}
+    selected = [(a in columns) and (b in columns) for a, b in
+                zip(zip(table['series_a'], table['fraction_a']), zip(table['series_b'], table['fraction_b']))]
+    return table[selected]
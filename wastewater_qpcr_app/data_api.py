@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+"""
+Read-only data API: the processed series of the layout entries as JSON,
+CSV or Parquet, filtered by series, pathogen, fraction and date range.
+
+    GET /api/series                   entries with their fractions, date range and version
+    GET /api/data?pathogen=SARS-CoV-2&fraction=F1&start=2025-01-01&end=2025-06-30&format=csv
+
+`series`, `pathogen` and `fraction` may be repeated (or comma-separated),
+`start` and `end` are inclusive dates. JSON and CSV are streamed in chunks
+of CHUNK_ROWS rows; Parquet needs pyarrow (or fastparquet) and is built in
+memory. Responses carry an ETag from the data version and a Last-Modified
+from the files of the selected entries, and are revalidated with 304.
+"""
+import io
+import json
+import hashlib
+from datetime import datetime, timezone
+
+import pandas as pd
+
+# Rows per streamed chunk
+CHUNK_ROWS = 20000
+
+FORMATS = {
+    'json': 'application/json',
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+COLUMNS = ['series', 'pathogen', 'date', 'fraction', 'value', 'std']
+
+
+def parquet_engine():
+    """
+    Name of the installed Parquet engine, or None
+    """
+    for engine in ('pyarrow', 'fastparquet'):
+        try:
+            __import__(engine)
+            return engine
+        except ImportError:
+            continue
+    return None
+
+
+def query_list(args, name):
+    """
+    Values of a repeated or comma-separated query parameter
+    """
+    return [value.strip() for arg in args.getlist(name) for value in arg.split(',') if value.strip()]
+
+
+def parse_query(args, layout_config):
+    """
+    Validate the query parameters of /api/data, returns the filter as a dict.
+    Raises ValueError on invalid parameters.
+    """
+    fmt = args.get('format', 'json').lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    try:
+        series = [int(idx) for idx in query_list(args, 'series')]
+    except ValueError:
+        raise ValueError("series must be layout entry indexes")
+    unknown = [idx for idx in series if not 0 <= idx < len(layout_config)]
+    if unknown:
+        raise ValueError(f"unknown series {unknown}")
+    bounds = {}
+    for name in ('start', 'end'):
+        value = args.get(name)
+        try:
+            bounds[name] = pd.Timestamp(value).normalize() if value else None
+        except ValueError:
+            raise ValueError(f"invalid {name} date {value!r}")
+    if bounds['start'] is not None and bounds['end'] is not None and bounds['start'] > bounds['end']:
+        raise ValueError("start is after end")
+    return {
+        'series': series,
+        'pathogens': [p.lower() for p in query_list(args, 'pathogen')],
+        'fractions': query_list(args, 'fraction'),
+        'start': bounds['start'],
+        'end': bounds['end'],
+        'format': fmt,
+    }
+
+
+def selected_series(query, frames, layout_config):
+    """
+    Layout indexes of the loaded entries matching the series and pathogen filters
+    """
+    return [idx for idx in sorted(frames)
+            if (not query['series'] or idx in query['series'])
+            and (not query['pathogens'] or layout_config[idx]['pathogen'].lower() in query['pathogens'])]
+
+
+def etag(query, data_version):
+    """
+    Entity tag of a query over a version of the data
+    """
+    key = json.dumps([{k: str(v) for k, v in query.items()}, data_version], sort_keys=True)
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+def http_date(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc) if timestamp else None
+
+
+def select_rows(df, query):
+    """
+    Rows of an entry's long frame (ordered by date) inside the date range
+    and fraction filter
+    """
+    dates = df['Date'].to_numpy()
+    start = 0 if query['start'] is None else dates.searchsorted(query['start'].to_datetime64(), 'left')
+    end = len(df) if query['end'] is None else dates.searchsorted(query['end'].to_datetime64(), 'right')
+    df = df.iloc[start:end]
+    if query['fractions']:
+        df = df[df['Fraction'].astype(str).isin(query['fractions'])]
+    return df
+
+
+def output_frame(idx, df, pathogen):
+    """
+    An entry's rows with the API column names
+    """
+    return pd.DataFrame({
+        'series': idx,
+        'pathogen': pathogen,
+        'date': df['Date'].dt.strftime('%Y-%m-%d').to_numpy(),
+        'fraction': df['Fraction'].astype(str).to_numpy(),
+        'value': df['Value'].to_numpy(),
+        'std': df['Value_std'].to_numpy() if 'Value_std' in df.columns else float('nan'),
+    }, columns=COLUMNS)
+
+
+def chunks(parts):
+    """
+    Output frames of at most CHUNK_ROWS rows, given (idx, rows, pathogen) parts
+    """
+    for idx, df, pathogen in parts:
+        for start in range(0, len(df), CHUNK_ROWS):
+            yield output_frame(idx, df.iloc[start:start + CHUNK_ROWS], pathogen)
+
+
+# The streams yield bytes, streamed responses are passed through without encoding
+
+def stream_csv(parts):
+    yield (','.join(COLUMNS) + '\n').encode()
+    for chunk in chunks(parts):
+        yield chunk.to_csv(header=False, index=False, float_format='%.10g', lineterminator='\n').encode()
+
+
+def stream_json(parts, header):
+    """
+    {...header, "rows": [{"series": ..., "date": ..., ...}, ...]}, missing std as null
+    """
+    yield (json.dumps(header)[:-1] + ', "rows": [').encode()
+    first = True
+    for chunk in chunks(parts):
+        records = chunk.to_json(orient='records', double_precision=10)[1:-1]
+        if records:
+            yield (('' if first else ',') + records).encode()
+            first = False
+    yield b']}'
+
+
+def stream_parquet(parts, engine):
+    """
+    The whole Parquet file as one chunk (the format needs its footer written last)
+    """
+    buffer = io.BytesIO()
+    frames = list(chunks(parts))
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=COLUMNS)
+    df.to_parquet(buffer, engine=engine, index=False, row_group_size=CHUNK_ROWS)
+    yield buffer.getvalue()
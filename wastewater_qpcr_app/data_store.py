@@ -0,0 +1,391 @@
+#!/usr/bin/env python
+import os
+import json
+import logging
+import hashlib
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import derived
+import ingest
+import metrics
+import parse_cache
+import shared_store
+
+
+def read_wide(data_file):
+    """
+    Read a wide TSV (one row per fraction, one column per date) into a frame
+    with a DatetimeIndex of columns and float values
+    """
+    with metrics.timer('stage_seconds', stage='read'):
+        wide = pd.read_csv(data_file, sep='\t', index_col='DATE')
+        wide.index = wide.index.astype(str)
+    with metrics.timer('stage_seconds', stage='date_parse'):
+        wide.columns = pd.to_datetime(wide.columns, format='mixed', errors='coerce').normalize()
+        wide = wide.loc[:, wide.columns.notna()]
+    # cells such as '#VALUE!' are not measurements
+    with metrics.timer('stage_seconds', stage='numeric_parse'):
+        return wide.apply(pd.to_numeric, errors='coerce').astype('float64')
+
+
+# Function to process data files
+def process_data(data_file, std_file=None):
+    """
+    Return the long (Date, Fraction, Value[, Value_std]) frame of a wide TSV,
+    with datetime64 dates and categorical fractions, ordered by date then fraction.
+
+    Only observed cells are kept: fractions are sampled on different days and
+    an empty cell is a missing sample, not a zero (true zeros are kept).
+    Value_std is NaN where no std was measured for an observed value.
+    """
+    df = pd.DataFrame()
+    logging.debug(f"process_data: data_file={data_file}, std_file={std_file}")  # ADDED
+    try:
+        wide = read_wide(data_file)
+        n_fractions, n_dates = wide.shape
+        with metrics.timer('stage_seconds', stage='reshape'):
+            values = wide.to_numpy().T.ravel()
+            observed = ~np.isnan(values)
+            fraction_codes, fractions = pd.factorize(wide.index)
+            codes = np.tile(fraction_codes.astype(np.int32), n_dates)
+            df = pd.DataFrame({
+                'Date': np.repeat(wide.columns.to_numpy(), n_fractions)[observed],
+                'Fraction': pd.Categorical.from_codes(codes[observed], categories=fractions),
+                'Value': values[observed],
+            })
+        # formatting df.tail() is expensive, only do it when it is logged
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(f"Processed data: {data_file} {df.shape} ({n_fractions * n_dates - len(df)} missing) {df.tail()}")
+    except Exception as err:
+        logging.error(f"Error processing data file {data_file}: {err}")
+        raise
+
+    if std_file and os.path.exists(std_file):
+        try:
+            wide_std = read_wide(std_file)
+            with metrics.timer('stage_seconds', stage='merge'):
+                wide_std = wide_std.loc[~wide_std.index.duplicated(), ~wide_std.columns.duplicated()]
+                # align the std matrix to the data matrix, missing cells stay NaN
+                wide_std = wide_std.reindex(index=wide.index, columns=wide.columns)
+                df['Value_std'] = wide_std.to_numpy().T.ravel()[observed]
+            logging.info(f"Processed std data: {std_file} {df.shape}")
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug(f"Processed std data: {std_file} {df.tail()}")
+        except Exception as err:
+            logging.error(f"Error processing std file {std_file}: {err}")
+
+    return df
+
+
+def load_data(data_file, std_file=None):
+    """
+    Return the processed data frame from the parse cache, or process the
+    files and cache the result
+    """
+    files = [data_file, std_file] if std_file else [data_file]
+    with metrics.timer('stage_seconds', stage='parse_cache_load'):
+        df = parse_cache.load(files)
+    if df is None:
+        df = process_data(data_file, std_file)
+        parse_cache.save(files, df)
+    return df
+
+
+def file_signature(path):
+    """
+    Return the (mtime_ns, size) pair of a file, or None if it does not exist
+    """
+    try:
+        st = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+class DataStore:
+    """
+    Versioned in-process store of the processed data frame of every layout entry.
+
+    Each entry is keyed by its index in layout.json and tracks the signature
+    (mtime, size) of its data and std files. refresh() re-parses only the
+    entries whose files changed and publishes the new frames by swapping the
+    whole dict, so readers holding the previous dict are never affected.
+
+    With a `shared_dir`, the frames are published as memory-mapped snapshots
+    (see shared_store.py): one process parses and publishes a generation,
+    every process maps the current generation read-only instead of keeping
+    its own copy.
+
+    Derived entries (see derived.py) are computed in every process whenever
+    the data entries change, they are neither read from files nor published.
+    """
+    def __init__(self, layout_config, min_check_interval=5, shared_dir=None):
+        self.layout_config = layout_config
+        self.min_check_interval = min_check_interval
+        self.shared_dir = shared_dir
+        self.derived = derived.DerivedSeries(layout_config)
+        # entries read from data files
+        self.file_indexes = [idx for idx in range(len(layout_config)) if idx not in self.derived]
+        self._generation = None
+        # (frames, versions) published together as one tuple
+        self._state = ({}, {})
+        self._signatures = {}
+        self._lock = threading.Lock()
+        self._last_check = 0
+
+    @property
+    def data_frames(self):
+        # the dict is replaced on every change, never mutated in place
+        return self._state[0]
+
+    def _file_state(self):
+        """
+        Copies of the (frames, versions) dicts of the data entries
+        """
+        frames, versions = self._state
+        return ({idx: df for idx, df in frames.items() if idx not in self.derived},
+                {idx: ver for idx, ver in versions.items() if idx not in self.derived})
+
+    def _set_state(self, frames, versions):
+        # derived entries are recomputed from the new data (memoized on their inputs)
+        self._state = self.derived.apply(frames, versions)
+
+    def get(self, idx):
+        """
+        Return the (data frame, version) pair of a layout entry
+        """
+        frames, versions = self._state
+        return frames[idx], versions[idx]
+
+    def files(self, idx):
+        config = self.layout_config[idx]
+        std_file = config.get('plot_std_tsv')
+        return [config['plot_data_tsv'], std_file] if std_file else [config['plot_data_tsv']]
+
+    def log_file(self, idx):
+        return ingest.log_path(self.layout_config[idx]['plot_data_tsv'])
+
+    def version(self, idx):
+        return self._state[1].get(idx)
+
+    def versions(self):
+        """
+        Return per-entry versions with string keys (as they round-trip through dcc.Store)
+        """
+        return {str(idx): ver for idx, ver in self._state[1].items()}
+
+    def snapshot(self):
+        """
+        Return the current data frames together with the matching store version
+        """
+        frames, versions = self._state
+        versions = {str(idx): ver for idx, ver in versions.items()}
+        return frames, hashlib.sha1(json.dumps(versions, sort_keys=True).encode()).hexdigest()[:12]
+
+    def memory_usage(self):
+        """
+        Return the memory used by each entry's data frame in bytes
+        """
+        return {idx: int(df.memory_usage(deep=True).sum()) for idx, df in self.data_frames.items()}
+
+    def latest_mtime(self, indexes=None):
+        """
+        Latest modification time (seconds) of all files known to the store,
+        or of the files of the given entries (derived entries count the
+        files of their sources)
+        """
+        pending, seen = list(self._signatures if indexes is None else indexes), set()
+        while pending:
+            idx = pending.pop()
+            if idx in self.derived and idx not in seen:
+                pending += derived.sources(self.derived.specs[idx])
+            seen.add(idx)
+        mtimes = [sig[0] for idx in seen for sig in self._signatures.get(idx, ()) if sig]
+        return max(mtimes) / 1e9 if mtimes else 0
+
+    def _signature(self, idx):
+        # data and std files, then the append log
+        return tuple(file_signature(f) for f in self.files(idx) + [self.log_file(idx)])
+
+    def _version(self, idx, signature):
+        """
+        Entry version: hash of the data/std files, followed by +<log size>
+        once rows were appended (see ingest.py)
+        """
+        *file_signatures, log_signature = signature
+        # the parse cache format changes with the output of process_data()
+        key = (parse_cache.CACHE_FORMAT, self.files(idx), tuple(file_signatures))
+        version = hashlib.sha1(repr(key).encode()).hexdigest()[:12]
+        return f"{version}+{log_signature[1]}" if log_signature and log_signature[1] else version
+
+    def _load_entry(self, idx, signature):
+        config = self.layout_config[idx]
+        df = load_data(config['plot_data_tsv'], config.get('plot_std_tsv'))
+        if signature[-1]:
+            # only the part of the log covered by the version
+            df = ingest.apply(df, ingest.read_log(self.log_file(idx), 0, signature[-1][1]))
+        logging.info(f"Loaded series {idx+1} ({config.get('pathogen')}): {len(df)} rows, "
+                     f"{df.memory_usage(deep=True).sum() / 1024:.1f} KiB")
+        return df, self._version(idx, signature)
+
+    def append(self, idx, rows):
+        """
+        Append new rows (see ingest.parse_rows) to an entry's log and data,
+        returns the new version of the entry. Raises ValueError if a row is
+        not newer than the last date of its fraction.
+        """
+        if idx in self.derived:
+            raise ValueError(f"Series {idx} is derived from other series, append to its sources")
+        log_file = self.log_file(idx)
+        with self._lock, ingest.locked(log_file):
+            if self.shared_dir:
+                # map the latest data before validating against it
+                self._refresh_shared(blocking=True)
+            elif self._signature(idx) != self._signatures.get(idx):
+                # files changed since the last refresh (e.g. another worker appended)
+                frames, versions = self._file_state()
+                if self._reload_changed(frames, versions):
+                    self._set_state(frames, versions)
+
+            df = self.data_frames[idx]
+            ingest.check_append(df, rows)
+            ingest.append_rows(log_file, rows)
+            logging.info(f"Appended {len(rows)} rows to the log of graph {idx+1}: {log_file}")
+
+            if self.shared_dir:
+                self._refresh_shared(blocking=True)
+            else:
+                signature = self._signature(idx)
+                self._signatures[idx] = signature
+                frames, versions = self._file_state()
+                frames[idx], versions[idx] = ingest.apply(df, rows), self._version(idx, signature)
+                self._set_state(frames, versions)
+            return self.version(idx)
+
+    def appended(self, idx, since):
+        """
+        Rows appended to an entry since an earlier version of it, or None if
+        the entry changed otherwise (e.g. its data TSV was rewritten)
+        """
+        version = self.version(idx)
+        if not since or version is None:
+            return None
+        base, end = ingest.split_version(version)
+        since_base, start = ingest.split_version(since)
+        if since_base != base or start >= end:
+            return None
+        return ingest.read_log(self.log_file(idx), start, end)
+
+    def load(self):
+        """
+        Load every layout entry, called once at startup
+        """
+        if self.shared_dir:
+            with self._lock:
+                self._refresh_shared(blocking=True)
+                self._last_check = time.monotonic()
+            return list(self.data_frames)
+
+        with self._lock:
+            frames, versions = {}, {}
+            for idx in self.file_indexes:
+                signature = self._signature(idx)
+                try:
+                    frames[idx], versions[idx] = self._load_entry(idx, signature)
+                except Exception as e:
+                    logging.error(f"Failed to process data for graph {idx+1}: {e}")
+                self._signatures[idx] = signature
+            self._set_state(frames, versions)
+            self._last_check = time.monotonic()
+        return list(frames)
+
+    def refresh(self, force=False):
+        """
+        Re-parse the entries whose data or std file changed on disk.
+
+        Returns the list of layout indexes that were reloaded. Checks are
+        throttled to one per `min_check_interval` seconds unless forced.
+        If a changed file fails to parse, the previous frame is kept.
+        """
+        now = time.monotonic()
+        if not force and now - self._last_check < self.min_check_interval:
+            return []
+        if not self._lock.acquire(blocking=False):
+            # another thread is already refreshing
+            return []
+        try:
+            self._last_check = now
+            if self.shared_dir:
+                return self._refresh_shared()
+
+            frames, versions = self._file_state()
+            changed = self._reload_changed(frames, versions)
+            if changed:
+                self._set_state(frames, versions)
+            return changed
+        finally:
+            self._lock.release()
+
+    def _reload_changed(self, frames, versions):
+        """
+        Re-parse the changed entries into the given dicts, returns their indexes
+        """
+        changed = []
+        for idx in self.file_indexes:
+            signature = self._signature(idx)
+            if signature == self._signatures.get(idx):
+                continue
+            self._signatures[idx] = signature
+            try:
+                frames[idx], versions[idx] = self._load_entry(idx, signature)
+                changed.append(idx)
+                logging.info(f"Reloaded data for graph {idx+1}: {self.files(idx)}")
+            except Exception as e:
+                logging.error(f"Failed to reload data for graph {idx+1}, keeping previous data: {e}")
+        return changed
+
+    def _adopt(self, generation):
+        """
+        Map a published generation, returns the indexes whose version changed
+        """
+        with metrics.timer('stage_seconds', stage='shared_adopt'):
+            frames, versions, signatures = shared_store.open_generation(self.shared_dir, generation)
+        old_versions = self._state[1]
+        self._signatures = signatures
+        self._set_state(frames, versions)
+        self._generation = generation
+        return [idx for idx, ver in self._state[1].items() if old_versions.get(idx) != ver]
+
+    def _refresh_shared(self, blocking=False):
+        """
+        Map the current shared generation and, if files changed on disk,
+        publish a new one (unless another process is already doing it)
+        """
+        changed = []
+        generation = shared_store.current_generation(self.shared_dir)
+        if generation and generation != self._generation:
+            changed += self._adopt(generation)
+        if self._generation and all(self._signature(idx) == self._signatures.get(idx)
+                                    for idx in self.file_indexes):
+            return changed
+
+        with shared_store.publish_lock(self.shared_dir, blocking=blocking) as locked:
+            if not locked:
+                # another process is publishing, its generation is adopted on a later refresh
+                return changed
+            generation = shared_store.current_generation(self.shared_dir)
+            if generation and generation != self._generation:
+                changed += self._adopt(generation)
+
+            frames, versions = self._file_state()
+            if self._reload_changed(frames, versions) or self._generation is None:
+                with metrics.timer('stage_seconds', stage='shared_publish'):
+                    generation = shared_store.publish(self.shared_dir, frames, versions, self._signatures,
+                                                      previous=self._generation)
+                changed += self._adopt(generation)
+
+        return sorted(set(changed))
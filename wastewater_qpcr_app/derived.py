@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+"""
+Derived series declared in layout.json.
+
+A layout entry with a "derived" object instead of data files is computed
+from other entries, referenced by their index in layout.json (as in
+/api/stats):
+
+    {"op": "ratio", "numerator": 0, "denominator": 9}
+    {"op": "ratio", "numerator": 0, "denominator": 9, "denominator_fraction": "F1"}
+    {"op": "rolling_mean", "series": 0, "days": 14}
+    {"op": "rolling_median", "series": 0, "days": 14, "min_periods": 2}
+    {"op": "log", "series": 0, "base": 10}
+
+A ratio divides the values of the same date and fraction, or of the same
+date only when the denominator has a single fraction (or
+denominator_fraction picks one). Rolling windows cover the observed samples
+of each fraction in the `days` days up to and including each date. Sources
+must be data entries or derived entries listed earlier in layout.json.
+
+The std of the result is propagated from the std of the inputs (first
+order, missing std ignored). Results are memoized on (spec, input
+versions) with LRU eviction, so a refresh only recomputes the derived
+entries whose inputs changed.
+"""
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import metrics
+
+# sqrt(pi/2), asymptotic std of the median relative to the mean of normal samples
+MEDIAN_STD_FACTOR = 1.2533
+
+
+def sources(spec):
+    """
+    Layout indexes of the inputs of a derived series
+    """
+    if spec['op'] == 'ratio':
+        return [spec['numerator'], spec['denominator']]
+    return [spec['series']]
+
+
+def _std(df):
+    if 'Value_std' in df.columns:
+        return df['Value_std'].to_numpy(dtype='float64')
+    return np.full(len(df), np.nan)
+
+
+def _frame(dates, fractions, values, std, with_std):
+    """
+    Long frame of a derived series: finite values only, ordered by date
+    """
+    df = pd.DataFrame({'Date': dates, 'Fraction': pd.Categorical(fractions), 'Value': values})
+    if with_std:
+        df['Value_std'] = std
+    df = df[np.isfinite(df['Value'].to_numpy())]
+    return df.sort_values(['Date', 'Fraction'], kind='stable', ignore_index=True)
+
+
+def ratio(numerator, denominator, denominator_fraction=None):
+    """
+    numerator / denominator on aligned dates (and fractions), with
+    std_r = |r| * sqrt((std_a / a)^2 + (std_b / b)^2)
+    """
+    den = denominator[['Date', 'Fraction', 'Value']].assign(Value_std=_std(denominator))
+    den['Fraction'] = den['Fraction'].astype(str)
+    if denominator_fraction is not None:
+        den = den[den['Fraction'] == denominator_fraction]
+    if denominator_fraction is not None or den['Fraction'].nunique() == 1:
+        keys = ['Date']
+        den = den.drop(columns='Fraction')
+    else:
+        keys = ['Date', 'Fraction']
+    num = numerator[['Date', 'Fraction', 'Value']].assign(Value_std=_std(numerator))
+    num['Fraction'] = num['Fraction'].astype(str)
+    merged = num.merge(den, on=keys, suffixes=('', '_den'))
+
+    a, b = merged['Value'].to_numpy(), merged['Value_den'].to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        value = a / b
+        rel_a = merged['Value_std'].to_numpy() / a
+        rel_b = merged['Value_std_den'].to_numpy() / b
+    variance = np.nansum([rel_a ** 2, rel_b ** 2], axis=0)
+    variance[np.isnan(rel_a) & np.isnan(rel_b)] = np.nan
+    with_std = 'Value_std' in numerator.columns or 'Value_std' in denominator.columns
+    return _frame(merged['Date'].to_numpy(), merged['Fraction'].to_numpy(), value,
+                  np.abs(value) * np.sqrt(variance), with_std)
+
+
+def rolling(df, days, how='mean', min_periods=1):
+    """
+    Rolling mean or median of each fraction over the last `days` days, with
+    std_mean = rms(std) / sqrt(n) (times MEDIAN_STD_FACTOR for the median)
+    """
+    window = f"{int(days)}D"
+    with_std = 'Value_std' in df.columns
+    parts = []
+    for fraction, positions in df.groupby('Fraction', sort=False, observed=True).indices.items():
+        part = df.iloc[positions]
+        values = pd.Series(part['Value'].to_numpy(), index=pd.DatetimeIndex(part['Date']))
+        windows = values.rolling(window, min_periods=min_periods)
+        value = windows.mean() if how == 'mean' else windows.median()
+        std = np.full(len(part), np.nan)
+        if with_std:
+            squares = pd.Series(part['Value_std'].to_numpy() ** 2, index=values.index)
+            rms = np.sqrt(squares.rolling(window, min_periods=1).mean())
+            std = (rms / np.sqrt(windows.count())).to_numpy()
+            if how == 'median':
+                std = std * MEDIAN_STD_FACTOR
+        parts.append(_frame(values.index.to_numpy(), np.full(len(part), fraction, dtype=object),
+                            value.to_numpy(), std, with_std))
+    if not parts:
+        return _frame([], [], np.array([]), np.array([]), with_std)
+    out = pd.concat(parts, ignore_index=True)
+    return out.sort_values(['Date', 'Fraction'], kind='stable', ignore_index=True)
+
+
+def log(df, base=10):
+    """
+    Logarithm of the positive values, with std_log = std / (x ln(base))
+    """
+    df = df[df['Value'] > 0]
+    values = df['Value'].to_numpy(dtype='float64')
+    return _frame(df['Date'].to_numpy(), df['Fraction'].astype(str).to_numpy(),
+                  np.log(values) / np.log(base), _std(df) / (values * np.log(base)),
+                  'Value_std' in df.columns)
+
+
+def compute(spec, frames):
+    """
+    Compute one derived series from the frames of its sources
+    """
+    op = spec['op']
+    if op == 'ratio':
+        return ratio(frames[spec['numerator']], frames[spec['denominator']], spec.get('denominator_fraction'))
+    if op in ('rolling_mean', 'rolling_median'):
+        return rolling(frames[spec['series']], spec['days'], how=op.split('_')[1],
+                       min_periods=spec.get('min_periods', 1))
+    if op == 'log':
+        return log(frames[spec['series']], spec.get('base', 10))
+    raise ValueError(f"Unknown derived series op {op!r}")
+
+
+class DerivedSeries:
+    """
+    The derived entries of a layout, memoized on (spec, input versions) with
+    LRU eviction of the least recently used results beyond `maxsize`
+    """
+    def __init__(self, layout_config, maxsize=32):
+        self.specs = {idx: config['derived'] for idx, config in enumerate(layout_config) if 'derived' in config}
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, idx):
+        return idx in self.specs
+
+    def _get(self, key, spec, frames):
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        with metrics.timer('stage_seconds', stage='derive'):
+            df = compute(spec, frames)
+        with self._lock:
+            self._cache[key] = df
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return df
+
+    def apply(self, frames, versions):
+        """
+        Return (frames, versions) of the data entries plus every derived
+        entry whose sources are available
+        """
+        frames = {idx: df for idx, df in frames.items() if idx not in self.specs}
+        versions = {idx: ver for idx, ver in versions.items() if idx not in self.specs}
+        for idx, spec in self.specs.items():
+            missing = [src for src in sources(spec) if src not in frames]
+            if missing:
+                logging.error(f"Skipping derived series {idx+1}, sources not loaded "
+                              f"(or not listed before it): {[src+1 for src in missing]}")
+                continue
+            key = (json.dumps(spec, sort_keys=True), tuple(versions[src] for src in sources(spec)))
+            try:
+                frames[idx] = self._get(key, spec, frames)
+            except Exception as e:
+                logging.error(f"Failed to derive series {idx+1}: {e}")
+                continue
+            versions[idx] = hashlib.sha1(repr(key).encode()).hexdigest()[:12]
+        return frames, versions
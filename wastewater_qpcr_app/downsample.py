@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+import numpy as np
+import pandas as pd
+
+
+def lttb(x, y, n_out):
+    """
+    Return the indices of the points kept by Largest-Triangle-Three-Buckets
+
+    The first and last points are always kept; the points in between are
+    split into n_out-2 buckets and the point of each bucket forming the
+    largest triangle with the previously kept point and the average of the
+    next bucket is selected.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+
+    kept = np.empty(n_out, dtype=int)
+    kept[0], kept[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x = x[end:edges[i + 2]].mean()
+            next_y = y[end:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        area = np.abs(
+            (x[a] - next_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (next_y - y[a])
+        )
+        a = start + int(np.argmax(area))
+        kept[i + 1] = a
+
+    return kept
+
+
+def _positions(df, window, max_points):
+    """
+    Row positions of df to keep: the LTTB overview of each fraction plus,
+    when a (start, end) window is given, the full-resolution points inside it
+    (themselves reduced to max_points if needed)
+    """
+    dates = df['Date'].to_numpy()
+    values = df['Value'].to_numpy()
+    keep = []
+    for positions in df.groupby('Fraction', sort=False, observed=True).indices.values():
+        x = dates[positions].astype('datetime64[ns]').astype('int64')
+        y = values[positions]
+        kept = positions[lttb(x, y, max_points)]
+        if window is not None:
+            inside = (dates[positions] >= window[0]) & (dates[positions] <= window[1])
+            kept = kept[~inside[np.searchsorted(positions, kept)]]
+            zoomed = positions[inside]
+            if len(zoomed) > max_points:
+                zoomed = zoomed[lttb(x[inside], y[inside], max_points)]
+            kept = np.concatenate([kept, zoomed])
+        keep.append(kept)
+
+    return np.sort(np.concatenate(keep)) if keep else np.arange(0)
+
+
+def needs_downsampling(df, max_points):
+    return bool(len(df)) and df['Fraction'].value_counts().max() > max_points
+
+
+def downsample_frame(df, max_points, window=None):
+    """
+    Reduce each fraction of a long data frame to at most max_points rows
+    (plus the full-resolution rows of the window, if given)
+    """
+    if not needs_downsampling(df, max_points):
+        return df
+    return df.iloc[_positions(df, window, max_points)].reset_index(drop=True)
+
+
+def relayout_window(relayout_data):
+    """
+    Return the (start, end) x-axis window of a dcc.Graph relayoutData, or
+    None if it does not describe an x-axis range
+    """
+    if not relayout_data:
+        return None
+    if 'xaxis.range[0]' in relayout_data and 'xaxis.range[1]' in relayout_data:
+        bounds = relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]']
+    elif 'xaxis.range' in relayout_data:
+        bounds = relayout_data['xaxis.range']
+    else:
+        return None
+
+    try:
+        start, end = (pd.Timestamp(b).to_datetime64() for b in bounds)
+    except (ValueError, TypeError):
+        return None
+    return (start, end) if start <= end else (end, start)
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+import json
+import logging
+import threading
+
+import metrics
+
+
+class FigureCache:
+    """
+    Serialized figure JSON keyed on (layout index, data version).
+
+    Only the figure of the current data version is kept for each index, so an
+    entry is replaced (invalidated) exactly when the underlying data changes.
+    `build(idx, df)` must return a plotly figure.
+    """
+    def __init__(self, build):
+        self.build = build
+        self._figures = {}
+        self._lock = threading.Lock()
+
+    def get_json(self, idx, version, df):
+        cached = self._figures.get(idx)
+        if cached is not None and cached[0] == version:
+            metrics.inc('figure_cache_total', result='hit')
+            return cached[1]
+
+        with self._lock:
+            # another thread may have built it while we waited
+            cached = self._figures.get(idx)
+            if cached is not None and cached[0] == version:
+                metrics.inc('figure_cache_total', result='hit')
+                return cached[1]
+            metrics.inc('figure_cache_total', result='miss')
+            logging.debug(f"Building figure {idx+1} for data version {version}")
+            with metrics.timer('stage_seconds', stage='figure_build'):
+                fig_json = self.build(idx, df).to_json()
+            self._figures[idx] = (version, fig_json)
+            return fig_json
+
+    def get(self, idx, version, df):
+        """
+        Return the figure as a dict, ready to use as a dcc.Graph figure
+        """
+        return json.loads(self.get_json(idx, version, df))
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+"""
+Resized variants of the analysis images of the trend cards.
+
+The images in assets/data/images are several thousand pixels wide, far more
+than the modal shows. Each image is served as WebP and PNG variants of the
+WIDTHS (none wider than the image itself), generated with Pillow on first
+request and cached on disk as
+
+    <cache_dir>/<source hash>-<width>.<format>
+
+The source hash is part of the variant URLs, so variants can be cached by
+browsers and proxies for a year: a new image gets new URLs. Without Pillow
+the original images are served as before.
+
+Pre-generate the variants, e.g. at image build time:
+
+    python images.py [--layout assets/data/layout.json] [--cache-dir .cache/images]
+"""
+import os
+import logging
+import argparse
+import threading
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+import metrics
+import parse_cache
+
+# Variant widths in pixels, up to the modal (xl) at twice its CSS width
+WIDTHS = [640, 1140, 1600, 2280]
+
+FORMATS = {
+    'webp': 'image/webp',
+    'png': 'image/png',
+}
+
+WEBP_QUALITY = 80
+
+# Width of the src of browsers without srcset support
+DEFAULT_WIDTH = 1140
+
+# Cache lifetime of the variants (their URLs change with the source)
+MAX_AGE = 365 * 24 * 3600
+
+# Display width of the image in the modal, for the browser to pick a variant
+SIZES = "(min-width: 1200px) 1110px, 95vw"
+
+cache_dir = os.environ.get('WW_IMAGE_CACHE_DIR', '.cache/images')
+
+_sources = {}
+_locks = {}
+_lock = threading.Lock()
+
+
+def available():
+    return Image is not None
+
+
+def source_info(path):
+    """
+    {'hash', 'width', 'height'} of a source image, memoized on its size and mtime
+    """
+    st = os.stat(path)
+    key = (path, st.st_size, st.st_mtime_ns)
+    info = _sources.get(path)
+    if info is None or info['key'] != key:
+        # only the header is read for the size
+        with Image.open(path) as im:
+            width, height = im.size
+        info = {'key': key, 'hash': parse_cache.content_hash(path)[:16], 'width': width, 'height': height}
+        _sources[path] = info
+    return info
+
+
+def widths(info):
+    """
+    Variant widths of a source image, none wider than the image itself
+    """
+    smaller = [width for width in WIDTHS if width < info['width']]
+    return smaller if len(smaller) == len(WIDTHS) else smaller + [info['width']]
+
+
+def default_width(info):
+    return min(widths(info), key=lambda width: abs(width - DEFAULT_WIDTH))
+
+
+def _resize(path, width, fmt, cache_file):
+    with metrics.timer('stage_seconds', stage='image'), Image.open(path) as im:
+        if fmt == 'png' and im.mode not in ('RGB', 'RGBA', 'L', 'LA', 'P'):
+            im = im.convert('RGBA')
+        height = round(im.height * width / im.width)
+        resized = im.resize((width, height), Image.LANCZOS, reducing_gap=3.0) if width < im.width else im.copy()
+        tmp_file = f"{cache_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            if fmt == 'webp':
+                resized.save(tmp_file, 'WEBP', quality=WEBP_QUALITY, method=4)
+            else:
+                resized.save(tmp_file, 'PNG', optimize=True)
+            os.replace(tmp_file, cache_file)
+        finally:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+    logging.info(f"Generated image variant {cache_file} of {path}")
+
+
+def variant(path, width, fmt):
+    """
+    Path of the cached variant of a source image, generated if missing.
+    The same variant is generated by one thread at a time.
+    """
+    info = source_info(path)
+    cache_file = os.path.join(cache_dir, f"{info['hash']}-{width}.{fmt}")
+    if os.path.exists(cache_file):
+        return cache_file
+    with _lock:
+        lock = _locks.setdefault(cache_file, threading.Lock())
+    with lock:
+        if not os.path.exists(cache_file):
+            os.makedirs(cache_dir, exist_ok=True)
+            _resize(path, width, fmt, cache_file)
+    with _lock:
+        _locks.pop(cache_file, None)
+    return cache_file
+
+
+def srcset(url, info, fmt):
+    """
+    srcset attribute of the variants of an image in a format, `url` being a
+    format string of the variant URL with {width} and {fmt} fields
+    """
+    return ', '.join(f"{url.format(width=width, fmt=fmt)} {width}w" for width in widths(info))
+
+
+def main():
+    global cache_dir
+
+    parser = argparse.ArgumentParser(description="Generate the image variants of the trend cards")
+    parser.add_argument('--layout', default='assets/data/layout.json', help="layout configuration file")
+    parser.add_argument('--cache-dir', default=cache_dir, help="variant cache directory")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+    cache_dir = args.cache_dir
+    if not available():
+        parser.error("Pillow is not installed")
+
+    import sites
+
+    _, layout_config = sites.load_layout(args.layout)
+    for config in layout_config:
+        path = config.get('analysis', {}).get('figure')
+        if not path or not os.path.exists(path):
+            continue
+        info = source_info(path)
+        for width in widths(info):
+            for fmt in FORMATS:
+                variant(path, width, fmt)
+    logging.info(f"Image variants in {cache_dir}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+"""
+Append-only ingest of new measurements.
+
+New (date, fraction, value, std) rows of a layout entry are appended to a
+long-format TSV log next to its data file (`<data file>.append.tsv`) and
+applied on top of the wide TSV whenever the entry is loaded. Appends must be
+of an existing fraction and newer than the last date of their fraction; new
+fractions and corrections of past values go through the wide TSV as before.
+
+The log only grows, so its size is a cursor: entry versions end with
+`+<log size>` and the rows appended since any earlier version of the same
+base files are the bytes of the log between the two sizes.
+
+Append rows from the command line (the running app picks them up on its
+next refresh):
+
+    python ingest.py --series 0 rows.tsv [--site lanl] [--layout assets/data/layout.json]
+
+where rows.tsv has date, fraction, value and (optionally) std columns.
+"""
+import io
+import os
+import fcntl
+import argparse
+import logging
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+LOG_COLUMNS = ['Date', 'Fraction', 'Value', 'Value_std']
+
+
+def log_path(data_file):
+    return f"{os.path.splitext(data_file)[0]}.append.tsv"
+
+
+def split_version(version):
+    """
+    Split an entry version into (base version, log size)
+    """
+    base, _, size = (version or '').partition('+')
+    return base, int(size or 0)
+
+
+@contextmanager
+def locked(log_file):
+    """
+    Exclusive lock on a log, held while rows are validated and appended
+    """
+    with open(f"{log_file}.lock", 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def parse_rows(rows):
+    """
+    Validate rows given as dicts (date, fraction, value and optional std)
+    and return them as a (Date, Fraction, Value, Value_std) frame.
+    Raises ValueError on invalid rows.
+    """
+    if not isinstance(rows, list) or not rows:
+        raise ValueError("rows must be a non-empty list")
+    try:
+        df = pd.DataFrame({
+            'Date': [row['date'] for row in rows],
+            'Fraction': [str(row['fraction']).strip() for row in rows],
+            'Value': [row['value'] for row in rows],
+            'Value_std': [row.get('std') for row in rows],
+        })
+    except (KeyError, TypeError, AttributeError) as err:
+        raise ValueError(f"every row needs date, fraction and value: {err}")
+
+    dates = pd.to_datetime(df['Date'], errors='coerce', format='mixed')
+    if dates.isna().any():
+        raise ValueError(f"invalid dates: {df.loc[dates.isna(), 'Date'].tolist()[:5]}")
+    df['Date'] = dates.dt.normalize()
+    for col in ['Value', 'Value_std']:
+        values = pd.to_numeric(df[col], errors='coerce').astype('float64')
+        invalid = ~np.isfinite(values) & (df[col].notna() if col == 'Value_std' else True)
+        if invalid.any():
+            raise ValueError(f"invalid {col.lower()}s: {df.loc[invalid, col].tolist()[:5]}")
+        df[col] = values
+    if (df['Fraction'] == '').any() or df['Fraction'].str.contains('[\t\n]', regex=True).any():
+        raise ValueError("fractions must be non-empty and without tabs or newlines")
+    if df.duplicated(['Date', 'Fraction']).any():
+        raise ValueError("duplicate (date, fraction) rows")
+    return df.sort_values('Date', kind='stable', ignore_index=True)
+
+
+def check_append(df, rows):
+    """
+    Raise ValueError unless every row is of a fraction of df (a new fraction
+    would change the traces of the figure) and newer than the last date of
+    its fraction
+    """
+    fractions = df['Fraction'].cat.categories if isinstance(df['Fraction'].dtype, pd.CategoricalDtype) \
+        else pd.unique(df['Fraction'])
+    unknown = sorted(set(rows['Fraction']) - set(map(str, fractions)))
+    if unknown:
+        raise ValueError(f"Unknown fractions {unknown}, the series has {[str(f) for f in fractions]}; "
+                         f"add new fractions to the data TSV")
+
+    last = df.groupby('Fraction', sort=False, observed=True)['Date'].max()
+    previous = rows['Fraction'].map(last)
+    stale = previous.notna() & (rows['Date'] <= previous)
+    if stale.any():
+        stale_rows = rows[stale]
+        raise ValueError(f"{len(stale_rows)} rows are not newer than the last date of their fraction "
+                         f"(e.g. {stale_rows['Fraction'].iloc[0]} on {stale_rows['Date'].iloc[0]:%Y-%m-%d}); "
+                         f"update the data TSV to revise past values")
+
+
+def append_rows(log_file, rows):
+    """
+    Append validated rows to the log (the caller holds the lock), returns the new log size
+    """
+    with open(log_file, 'a') as f:
+        rows[LOG_COLUMNS].to_csv(f, sep='\t', header=f.tell() == 0, index=False,
+                                 date_format='%Y-%m-%d', float_format='%.10g', lineterminator='\n')
+        f.flush()
+        os.fsync(f.fileno())
+        return f.tell()
+
+
+def read_log(log_file, start=0, end=None):
+    """
+    Rows of the log between byte offsets start and end (the whole log by default)
+    """
+    try:
+        with open(log_file, 'rb') as f:
+            f.seek(start)
+            data = f.read(-1 if end is None else end - start)
+    except FileNotFoundError:
+        data = b''
+    if start == 0:
+        # skip the header line
+        data = data.partition(b'\n')[2]
+    if not data.strip():
+        return pd.DataFrame({'Date': pd.Series(dtype='datetime64[us]'), 'Fraction': pd.Series(dtype='str'),
+                             'Value': pd.Series(dtype='float64'), 'Value_std': pd.Series(dtype='float64')})
+
+    df = pd.read_csv(io.BytesIO(data), sep='\t', names=LOG_COLUMNS, header=None,
+                     dtype={'Fraction': 'str', 'Value': 'float64', 'Value_std': 'float64'})
+    df['Date'] = pd.to_datetime(df['Date'], format='%Y-%m-%d')
+    return df
+
+
+def apply(df, rows):
+    """
+    Return the long data frame with the appended rows applied, a row replaces
+    an existing one of the same date and fraction
+    """
+    if not len(rows):
+        return df
+    # missing std stays NaN as in process_data()
+    rows = rows.astype({'Date': df['Date'].dtype})
+    out = pd.concat([df, rows[list(df.columns)]], ignore_index=True)
+    out = out.drop_duplicates(['Date', 'Fraction'], keep='last')
+    # fractions are categorical, new ones are added as categories
+    out['Fraction'] = pd.Categorical(out['Fraction'].astype(str), categories=pd.unique(out['Fraction'].astype(str)))
+    return out.sort_values('Date', kind='stable', ignore_index=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Append new measurements to a layout entry")
+    parser.add_argument('rows', help="TSV file with date, fraction, value and (optionally) std columns")
+    parser.add_argument('--series', type=int, required=True, help="layout entry index (as in /api/stats)")
+    parser.add_argument('--layout', default='assets/data/layout.json', help="layout configuration file")
+    parser.add_argument('--site', help="site id (the default site if not given)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+    import sites
+    from data_store import DataStore
+
+    site_configs, layout_config = sites.load_layout(args.layout)
+    site = sites.find(site_configs, args.site)
+    if site is None:
+        parser.error(f"unknown site {args.site}")
+    rows = pd.read_csv(args.rows, sep='\t', dtype=str).rename(columns=str.lower)
+    rows = rows.astype(object).where(rows.notna(), None).to_dict(orient='records')
+
+    store = DataStore(sites.site_layout(layout_config, site))
+    store.load()
+    version = store.append(args.series, parse_rows(rows))
+    logging.info(f"Appended {len(rows)} rows to series {args.series} (version {version})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+"""
+In-process latency histograms and counters, rendered in the Prometheus text
+exposition format by the /metrics route.
+
+Every worker process keeps its own registry, so with several gunicorn
+workers each scrape shows the worker that answered it (label the scrape
+target per worker, or run a single worker, to aggregate).
+"""
+import time
+import bisect
+import threading
+import functools
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+PREFIX = 'wastewater_'
+
+HELP = {
+    'stage_seconds': "Duration of data loading and processing stages",
+    'callback_seconds': "Duration of Dash callbacks",
+    'callback_errors_total': "Dash callbacks that raised an exception",
+    'llm_request_seconds': "Duration of LLM requests",
+    'llm_first_token_seconds': "Time from sending an LLM request to its first streamed token",
+    'llm_errors_total': "LLM requests that failed",
+    'figure_cache_total': "Figure cache lookups by result",
+    'ingest_rows_total': "Rows appended through /api/ingest",
+}
+
+_lock = threading.Lock()
+# name -> {labels: [count per bucket..., count above the last bucket, sum, count]}
+_histograms = {}
+# name -> {labels: value}
+_counters = {}
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def observe(name, seconds, **labels):
+    """
+    Add one observation to histogram `name`
+    """
+    key = _labels(labels)
+    with _lock:
+        series = _histograms.setdefault(name, {})
+        values = series.get(key)
+        if values is None:
+            values = series[key] = [0] * (len(BUCKETS) + 3)
+        values[bisect.bisect_left(BUCKETS, seconds)] += 1
+        values[-2] += seconds
+        values[-1] += 1
+
+
+def inc(name, amount=1, **labels):
+    """
+    Increment counter `name`
+    """
+    key = _labels(labels)
+    with _lock:
+        series = _counters.setdefault(name, {})
+        series[key] = series.get(key, 0) + amount
+
+
+@contextmanager
+def timer(name, **labels):
+    """
+    Observe the duration of the with block in histogram `name`
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def timed_callback(func, name=None):
+    """
+    Wrap a Dash callback to record its latency and errors
+    """
+    name = name or func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            inc('callback_errors_total', callback=name)
+            raise
+        finally:
+            observe('callback_seconds', time.perf_counter() - start, callback=name)
+    return wrapper
+
+
+def _format_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in items)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + '}'
+
+
+def render():
+    """
+    All metrics in the Prometheus text exposition format
+    """
+    with _lock:
+        histograms = {name: {k: list(v) for k, v in series.items()} for name, series in _histograms.items()}
+        counters = {name: dict(series) for name, series in _counters.items()}
+
+    lines = []
+    for name, series in sorted(histograms.items()):
+        metric = PREFIX + name
+        if name in HELP:
+            lines.append(f"# HELP {metric} {HELP[name]}")
+        lines.append(f"# TYPE {metric} histogram")
+        for labels, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS, values):
+                cumulative += count
+                lines.append(f"{metric}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{metric}_bucket{_format_labels(labels, [('le', '+Inf')])} {values[-1]}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {values[-2]}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {values[-1]}")
+
+    for name, series in sorted(counters.items()):
+        metric = PREFIX + name
+        if name in HELP:
+            lines.append(f"# HELP {metric} {HELP[name]}")
+        lines.append(f"# TYPE {metric} counter")
+        for labels, value in sorted(series.items()):
+            lines.append(f"{metric}{_format_labels(labels)} {value}")
+
+    return '\n'.join(lines) + '\n'
@@ -2,129 +2,278 @@
 import pandas as pd
 import logging
 import os
-import json
+import hmac
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-import plotly.express as px
+import pytz
 import dash_bootstrap_components as dbc
 import dash
-from dash import dcc, html, State, Input, Output, callback, ctx, Patch, no_update, ALL
-import openai
-from openai import OpenAI
-import httpx
-import os
-from datetime import datetime, timedelta
+import flask
+from dash import dcc, html, State, Input, Output, callback, clientside_callback, ClientsideFunction, ctx, Patch, no_update
+from datetime import datetime, timezone
+
+from data_store import DataStore
+from figure_cache import FigureCache
+from summary_jobs import SummaryJobs
+import anomalies
+import compare
+import data_api
+import downsample
+import images
+import ingest
+import metrics
+import payload
+import series_stats
+import sites
+import trends
 
-# Configure logging
+# Configure logging (set WW_LOG_LEVEL, e.g. to DEBUG, for more detail)
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=os.environ.get('WW_LOG_LEVEL', 'INFO').upper(),
     format='%(asctime)s [%(levelname)s] %(message)s',
     datefmt='%Y-%m-%d %H:%M',
 )
 
-# Initialize OpenAI client - assuming you have the API key set in environment variable
-# Replace with your actual API key and base URL
-openai_api_key = "sk-Upattg2kt62WTYMOVjkVbA"
-openai_api_base = "https://aiportal-api.aws.lanl.gov/v1" # Or your custom base URL
-modal_name = "gpt-oss-120b"
+# Initialize OpenAI client - the API key, base URL and model can be set in environment variables
+# (e.g. point OPENAI_API_BASE to a local OpenAI-compatible stub for testing)
+openai_api_key = os.environ.get("OPENAI_API_KEY", "sk-Upattg2kt62WTYMOVjkVbA")
+openai_api_base = os.environ.get("OPENAI_API_BASE", "https://aiportal-api.aws.lanl.gov/v1") # Or your custom base URL
+modal_name = os.environ.get("OPENAI_MODEL", "gpt-oss-120b")
 
-client = openai.OpenAI(
-    api_key=openai_api_key,
-    base_url=openai_api_base,
-    http_client=httpx.Client(verify=False)
-)
+# Seconds to wait for an LLM response (and for the connection)
+llm_timeout = float(os.environ.get("WW_LLM_TIMEOUT", 120))
+llm_connect_timeout = 10
+
+# "sections" summarizes every pathogen in its own request, run concurrently, and
+# merges the sections into the briefing; "single" sends one prompt for all pathogens
+summary_mode = os.environ.get("WW_SUMMARY_MODE", "sections")
+# Concurrent section requests (shared by all jobs of this worker) and the time
+# allowed for each one in total, including streaming the answer
+section_pool = ThreadPoolExecutor(max_workers=int(os.environ.get("WW_SUMMARY_SECTION_WORKERS", 4)),
+                                  thread_name_prefix='ai-section')
+section_timeout = float(os.environ.get("WW_SUMMARY_SECTION_TIMEOUT", 60))
+
+# The client (and openai/httpx, slow to import) is created on first use, in the
+# worker process that uses it, and keeps its pooled connections for later requests
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import httpx
+                import openai
+                _client = openai.OpenAI(
+                    api_key=openai_api_key,
+                    base_url=openai_api_base,
+                    max_retries=1,
+                    http_client=httpx.Client(
+                        verify=False,
+                        timeout=httpx.Timeout(llm_timeout, connect=llm_connect_timeout),
+                        limits=httpx.Limits(max_connections=10, max_keepalive_connections=4, keepalive_expiry=60),
+                    )
+                )
+    return _client
 
 dash.register_page(__name__, path='/')
 
 # Function to generate AI summary
-def generate_ai_summary(data_frames, selected_pathogen, model=modal_name):
+def generate_ai_summary(data_frames, selected_pathogen, model=modal_name, derived=()):
     """
     Generate an AI summary of the pathogen data using OpenAI API
     """
     try:
-        # Prepare the data for summary
-        if selected_pathogen == 'all pathogens':
-            summary_text = "Summary of all pathogens in wastewater:\n\n"
-            for idx, config in enumerate(layout_config):
-                if idx in data_frames:
-                    df = data_frames[idx]
-                    pathogen = config['pathogen']
-                    latest_date = df['Date'].max()
-                    df_latest = df[df['Date'] == latest_date]
-                    one_week_ago = (datetime.strptime(latest_date, '%Y-%m-%d') - timedelta(days=7)).strftime('%Y-%m-%d')
-                    one_month_ago = (datetime.strptime(latest_date, '%Y-%m-%d') - timedelta(days=30)).strftime('%Y-%m-%d')
-                    df_month = df[df['Date'] >= one_month_ago]
-                    df_week = df[df['Date'] >= one_week_ago]
-
-                    summary_text += f"\n- {pathogen} ({config.get('plot_yaxis_title', 'units')}):\n"
-
-                    summary_text += f"\nLatest data from {latest_date}:\n"
-                    for _, row in df_latest.iterrows():
-                        summary_text += f"  {row['Fraction']}: {row['Value']}\n"
-
-                    # Calculate month-over-month trend
-                    if len(df_week) > 1:
-                        grouped = df_week.groupby('Fraction')['Value'].agg(['mean', 'min', 'max'])
-                        summary_text += f"\nWeek summary ({one_week_ago} to {latest_date}):\n"
-                        for frac, stats in grouped.iterrows():
-                            summary_text += f"{frac}: Mean={stats['mean']:.2f}, Range={stats['min']:.2f}-{stats['max']:.2f}\n"
-
-                    # Calculate month-over-month trend
-                    if len(df_month) > 1:
-                        grouped = df_month.groupby('Fraction')['Value'].agg(['mean', 'min', 'max'])
-                        summary_text += f"\nMonth summary ({one_month_ago} to {latest_date}):\n"
-                        for frac, stats in grouped.iterrows():
-                            summary_text += f"{frac}: Mean={stats['mean']:.2f}, Range={stats['min']:.2f}-{stats['max']:.2f}\n"
-
-        else:
-            # Get data for selected pathogen only
-            summary_text = f"Summary of {selected_pathogen} in wastewater:\n\n"
-            for idx, config in enumerate(layout_config):
-                if config['pathogen'] == selected_pathogen and idx in data_frames:
-                    df = data_frames[idx]
-                    latest_date = df['Date'].max()
-                    one_month_ago = (datetime.strptime(latest_date, '%Y-%m-%d') - timedelta(days=30)).strftime('%Y-%m-%d')
-                    df_latest = df[df['Date'] == latest_date]
-                    df_month = df[df['Date'] >= one_month_ago]
-                    
-                    summary_text += f"Latest data from {latest_date}\n"
-                    for _, row in df_latest.iterrows():
-                        summary_text += f"{row['Fraction']}: {row['Value']} {config.get('plot_yaxis_title', 'units')}\n"
-                    
-                    # Calculate month-over-month trend
-                    if len(df_month) > 1:
-                        grouped = df_month.groupby('Fraction')['Value'].agg(['mean', 'min', 'max'])
-                        summary_text += "\nMonth summary:\n"
-                        for frac, stats in grouped.iterrows():
-                            summary_text += f"{frac}: Mean={stats['mean']:.2f}, Range={stats['min']:.2f}-{stats['max']:.2f}\n"
-                    
-                    # if 'analysis' in config:
-                    #     summary_text += f"\nTrend analysis: {config['analysis'].get('trend', 'N/A')}\n"
-                    #     summary_text += f"Description: {config['analysis'].get('description', 'N/A')}\n"
-                    
-                    summary_text += f"\nData description: {config.get('description', '')}\n"
-        
-        logging.info("Sending request to OpenAI API:")
-        # Call OpenAI API to generate summary
-        user_prompts = f"Summarize the wastewater viral surveillance data for the last 7 days and a month for a briefing in 1 paragraph. Use plain language, no speculation. Convert large numbers into a human-readable abbreviated form (e.g. 3,453,358 to ~3.4M). Focus on: \n1) Key trends (increases/decreases) by pathogens;  \n2) Notable new detections;: \n\n{summary_text}"
-
-        response = client.chat.completions.create(
-            model=model, 
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that summarizes wastewater pathogen data. Provide clear insights about trends and significance of the data."},
-                {"role": "user", "content": user_prompts}
-            ],
-            max_tokens=1000
-        )
-        
-        summary = "AI summary: " + response.choices[0].message.content
-        logging.info("AI summary generated successfully")
-        
-        return summary
+        return request_ai_summary(data_frames, selected_pathogen, model, derived=derived)
     except Exception as e:
         logging.error(f"Error generating AI summary: {e}")
         return f"Error generating AI summary: {str(e)}"
 
+def events_text(events, idx, units):
+    # Spikes and new detections of the last days, computed so that the model does not have to
+    lines = [f"  {anomalies.describe(row, ' ' + units)}\n" for row in
+             anomalies.series_events(events, idx, anomalies.ALERT_DAYS).itertuples()]
+    return f"\nDetected events (last {anomalies.ALERT_DAYS} days):\n" + ("".join(lines) or "  none\n")
+
+def build_summary_text(stats, selected_pathogen, events=None, derived=()):
+    """
+    Build the data part of the AI summary prompt from the statistics table
+    and the event table (spikes and new detections). The `derived` entries
+    of the site's store are left out: they restate their source series
+    under the same pathogen and units.
+    """
+    # Prepare the data for summary
+    if selected_pathogen == 'all pathogens':
+        summary_text = "Summary of all pathogens in wastewater:\n\n"
+        for idx, config in enumerate(layout_config):
+            rows = series_stats.series_stats(stats, idx)
+            if idx in derived or not len(rows):
+                continue
+            latest_date = rows['latest_date'].iloc[0]
+            summary_text += f"\n- {config['pathogen']} ({config.get('plot_yaxis_title', 'units')}):\n"
+
+            summary_text += f"\nLatest data from {latest_date:%Y-%m-%d}:\n"
+            for row in rows.itertuples():
+                # fractions are sampled on different days
+                latest_value = row.latest_value if pd.notna(row.latest_value) else "not sampled"
+                summary_text += f"  {row.Fraction}: {latest_value}\n"
+
+            for name, label in [('week', 'Week'), ('month', 'Month')]:
+                # Calculate week/month-over-month trend
+                if rows[f'{name}_count'].sum() > 1:
+                    summary_text += f"\n{label} summary ({rows[f'{name}_start'].iloc[0]:%Y-%m-%d} to {latest_date:%Y-%m-%d}):\n"
+                    for row in rows[rows[f'{name}_count'] > 0].sort_values('Fraction').to_dict('records'):
+                        summary_text += f"{row['Fraction']}: Mean={row[f'{name}_mean']:.2f}, Range={row[f'{name}_min']:.2f}-{row[f'{name}_max']:.2f}\n"
+
+            if events is not None:
+                summary_text += events_text(events, idx, config.get('plot_yaxis_title', 'units'))
+
+    else:
+        # Get data for selected pathogen only
+        summary_text = f"Summary of {selected_pathogen} in wastewater:\n\n"
+        for idx, config in enumerate(layout_config):
+            rows = series_stats.series_stats(stats, idx)
+            if config['pathogen'] != selected_pathogen or idx in derived or not len(rows):
+                continue
+            summary_text += f"Latest data from {rows['latest_date'].iloc[0]:%Y-%m-%d}\n"
+            for row in rows[rows['latest_value'].notna()].itertuples():
+                summary_text += f"{row.Fraction}: {row.latest_value} {config.get('plot_yaxis_title', 'units')}\n"
+            
+            # Calculate month-over-month trend
+            if rows['month_count'].sum() > 1:
+                summary_text += "\nMonth summary:\n"
+                for row in rows[rows['month_count'] > 0].sort_values('Fraction').itertuples():
+                    summary_text += f"{row.Fraction}: Mean={row.month_mean:.2f}, Range={row.month_min:.2f}-{row.month_max:.2f}\n"
+
+            if events is not None:
+                summary_text += events_text(events, idx, config.get('plot_yaxis_title', 'units'))
+            
+            # if 'analysis' in config:
+            #     summary_text += f"\nTrend analysis: {config['analysis'].get('trend', 'N/A')}\n"
+            #     summary_text += f"Description: {config['analysis'].get('description', 'N/A')}\n"
+            
+            summary_text += f"\nData description: {config.get('description', '')}\n"
+
+    return summary_text
+
+SYSTEM_PROMPT = "You are a helpful assistant that summarizes wastewater pathogen data. Provide clear insights about trends and significance of the data."
+
+def stream_completion(prompt, model, max_tokens, on_text=None, timeout=None):
+    """
+    Request a chat completion as a stream, calling on_text(text so far) as
+    tokens arrive, and return the whole answer. With a timeout the request is
+    not retried and raises TimeoutError if the answer is not complete within
+    timeout seconds.
+    """
+    client = get_client() if timeout is None else get_client().with_options(max_retries=0)
+    timeout = timeout or llm_timeout
+    deadline = time.monotonic() + timeout
+    text = ""
+    start = time.perf_counter()
+    try:
+        with metrics.timer('llm_request_seconds', model=model):
+            stream = client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt}
+                ],
+                max_tokens=max_tokens,
+                stream=True,
+                timeout=timeout,
+            )
+            with stream:
+                for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta:
+                        if not text:
+                            metrics.observe('llm_first_token_seconds', time.perf_counter() - start, model=model)
+                        text += delta
+                        if on_text:
+                            on_text(text)
+                    if time.monotonic() > deadline:
+                        raise TimeoutError(f"no complete answer within {timeout:.0f}s")
+    except Exception:
+        metrics.inc('llm_errors_total', model=model)
+        raise
+    return text
+
+def request_section_summaries(stats, events, derived, model, progress):
+    """
+    Summarize each pathogen in its own request on the section pool and merge
+    the sections, in layout order, into one briefing. The briefing is reported
+    to progress() as the sections stream in; a failed section is replaced by a
+    note unless every section failed.
+    """
+    pathogens = list(dict.fromkeys(layout_config[idx]['pathogen'] for idx in sorted(stats['series'].unique())
+                                 if idx not in derived))
+    if not pathogens:
+        raise ValueError("No data to summarize")
+    sections = dict.fromkeys(pathogens, "")
+    lock = threading.Lock()
+
+    def briefing():
+        return "AI summary:\n\n" + "\n\n".join(f"**{p}:** {text}" for p, text in sections.items() if text)
+
+    def summarize(pathogen):
+        prompt = (f"Summarize the wastewater surveillance data of {pathogen} for the last 7 days and a month "
+                  f"in 2-3 sentences for a briefing. Use plain language, no speculation. Convert large numbers "
+                  f"into a human-readable abbreviated form (e.g. 3,453,358 to ~3.4M). Focus on key trends "
+                  f"(increases/decreases) and the detected events listed, if any: \n\n"
+                  f"{build_summary_text(stats, pathogen, events, derived)}")
+
+        def on_text(text):
+            with lock:
+                sections[pathogen] = text
+                progress(briefing())
+        return stream_completion(prompt, model, 300, on_text, section_timeout)
+
+    futures = {pathogen: section_pool.submit(summarize, pathogen) for pathogen in pathogens}
+    errors = []
+    for pathogen, future in futures.items():
+        try:
+            sections[pathogen] = future.result()
+        except Exception as e:
+            logging.error(f"Error generating the AI summary of {pathogen}: {e}")
+            errors.append(e)
+            sections[pathogen] = f"_summary unavailable ({e})_"
+    if len(errors) == len(pathogens):
+        raise errors[0]
+    return briefing()
+
+def request_ai_summary(data_frames, selected_pathogen, model=modal_name, stats=None, events=None, derived=(),
+                       progress=None):
+    """
+    Same as generate_ai_summary() but raises on errors. `derived` are the
+    derived entries of the site's store. progress(text) is called with the
+    partial summary while the answer streams in.
+    """
+    if stats is None:
+        stats = series_stats.compute_stats(data_frames)
+    if events is None:
+        events = detect_events(data_frames, derived)
+    progress = progress or (lambda text: None)
+
+    logging.info("Sending request to OpenAI API:")
+    if selected_pathogen == 'all pathogens' and summary_mode == 'sections':
+        summary = request_section_summaries(stats, events, derived, model, progress)
+        logging.info("AI summary generated successfully")
+        return summary
+
+    summary_text = build_summary_text(stats, selected_pathogen, events, derived)
+
+    # Call OpenAI API to generate summary
+    user_prompts = f"Summarize the wastewater viral surveillance data for the last 7 days and a month for a briefing in 1 paragraph. Use plain language, no speculation. Convert large numbers into a human-readable abbreviated form (e.g. 3,453,358 to ~3.4M). Focus on: \n1) Key trends (increases/decreases) by pathogens;  \n2) The detected events listed (spikes and new detections), if any;: \n\n{summary_text}"
+
+    content = stream_completion(user_prompts, model, 1000, lambda text: progress("AI summary: " + text))
+    summary = "AI summary: " + content
+    logging.info("AI summary generated successfully")
+    
+    return summary
+
 # Define styles
 PLOT_STYLE = {
     'marginTop': '1rem',
@@ -152,60 +301,25 @@ SIDEBAR_STYLE = {
     "max-height": "calc(100vh - 3rem)"
 }
 
-# Containers for graph layouts and data frames
-viz_layout_children = []
-data_frames = {}  # To store data frames for each graph
-check_files = []
-
-# Load layout configuration from JSON
+# Load layout configuration from JSON, the layout entries are the charts of every site (sites.py)
 layout_config_file = 'assets/data/layout.json'
 try:
-    with open(layout_config_file, 'r') as file:
-        layout_config = json.load(file)
-    logging.info(f"Loaded layout configuration from {layout_config_file}")
+    site_configs, layout_config = sites.load_layout(layout_config_file)
+    logging.info(f"Loaded layout configuration from {layout_config_file}: "
+                 f"{len(layout_config)} entries, {len(site_configs)} site(s)")
 except Exception as e:
     logging.error(f"Failed to load layout configuration: {e}")
-    layout_config = []
-
-# Function to process data files
-def process_data(data_file, std_file=None):
-    df = pd.DataFrame()
-    logging.debug(f"process_data: data_file={data_file}, std_file={std_file}")  # ADDED
-    try:
-        df = pd.read_csv(data_file, sep='\t')
-        df = df.set_index('DATE').unstack().reset_index().rename(
-            columns={'DATE': 'Fraction', 'level_0': 'Date', 0: 'Value'}
-        )
-        df['Date'] = pd.to_datetime(df['Date'], format='mixed', errors='coerce').dt.strftime('%Y-%m-%d')
-        df = df[df['Date'].notnull()].reset_index(drop=True)
-        df.fillna(0, inplace=True)
-        logging.debug(f"Processed data: {data_file} {df.shape} {df.tail()}")
-    except Exception as err:
-        logging.error(f"Error processing data file {data_file}: {err}")
-        raise
-
-    if std_file and os.path.exists(std_file):
-        try:
-            df_std = pd.read_csv(std_file, sep='\t')
-            df_std = df_std.set_index('DATE').unstack().reset_index().rename(
-                columns={'DATE': 'Fraction', 'level_0': 'Date', 0: 'Value'}
-            )
-            df_std['Date'] = pd.to_datetime(df_std['Date'], format='mixed', errors='coerce').dt.strftime('%Y-%m-%d')
-            df_std = df_std[df_std['Date'].notnull()].reset_index(drop=True)
-            df_std.fillna(0, inplace=True)
-            df = df.merge(df_std, on=['Date', 'Fraction'], how='left', suffixes=('', '_std'))
-            logging.info(f"Processed std data: {std_file} {df.shape} {df.tail()}")
-        except Exception as err:
-            logging.error(f"Error processing std file {std_file}: {err}")
-    
-    return df
+    site_configs, layout_config = [{'id': sites.DEFAULT_SITE, 'name': '', 'data_dir': sites.DATA_DIR}], []
+manifest_file = sites.manifest_path()
 
 # Function to generate figure
-def update_figure(plot_data):
-    
+def update_figure(plot_data, config, events=None):
+    # imported on first use, plotly.express is slow to import
+    import plotly.express as px
+
     # Calculate date range for x-axis
-    max_date = pd.to_datetime(plot_data['Date']).max() + pd.DateOffset(weeks=1)
-    min_date = pd.to_datetime(plot_data['Date']).min() - pd.DateOffset(weeks=1)
+    max_date = plot_data['Date'].max() + pd.DateOffset(weeks=1)
+    min_date = plot_data['Date'].min() - pd.DateOffset(weeks=1)
     
     fig = px.line(plot_data, 
                     x='Date',
@@ -236,99 +350,593 @@ def update_figure(plot_data):
                max_date.date()]
     )
     fig.update_traces(error_y_color="#AAAAAA", error_y_width=0.04, mode="markers+lines", hovertemplate=None)
-    fig.update_layout(hovermode="x unified")
+    fig.update_layout(hovermode="x unified", uirevision=True)  # keep zoom when data is patched
 
-    return fig
+    # Mark the spikes and new detections (anomalies.py)
+    if events is not None:
+        for row in events.itertuples():
+            fig.add_annotation(x=f"{row.Date:%Y-%m-%d}", y=row.value, text=anomalies.EVENT_LABELS[row.event],
+                               hovertext=anomalies.describe(row), showarrow=True, arrowhead=2, ax=0, ay=-30,
+                               font=dict(size=10), bgcolor="rgba(255, 255, 255, 0.8)")
 
+    # dates as epoch milliseconds, so x is sent as a binary typed array like y and error_y
+    return payload.encode_figure(fig)
 
-# Process each configuration's data and build graph layout blocks
-for idx, config in enumerate(layout_config):
-    data_file = config['plot_data_tsv']
-    std_file = config.get('plot_std_tsv')
-    check_files.extend([data_file, std_file] if std_file else [data_file])
-    
-    try:
-        df = process_data(data_file, std_file)
-        data_frames[idx] = df
-    except Exception as e:
-        logging.error(f"Failed to process data for graph {idx+1}: {e}")
 
-    # Skip if no data is available
-    if idx not in data_frames:
-        logging.error(f"Skipping config {idx+1}")
-        continue
-    
-    # Generate figure
-    fig = update_figure(df)
+# Maximum number of points sent per fraction, longer series are downsampled (LTTB)
+# and the full-resolution points are fetched for the zoomed window only
+MAX_POINTS_PER_TRACE = 1000
 
-    # Build graph block
-    block_id = f"chart{idx+1}-block-id"
-    graph_id = f"chart{idx+1}-graph-id"
+def detect_events(frames, derived):
+    # Derived series (the `derived` of the site's store) are smoothed or scaled copies
+    # of the data, their events would only repeat
+    return anomalies.detect_events({idx: df for idx, df in frames.items() if idx not in derived})
 
-    logging.info(f"Appending plot: {config['title']}")
+def entry_events(idx, df, derived):
+    # Events of one entry's figure, from the same frame so that they match its data version
+    return None if idx in derived else detect_events({idx: df}, derived)
 
-    viz_layout_children.append(
-        html.Div(
-            [
-                html.H4(
-                    config["title"],
-                    className="mr-3",
-                    style={'display':'inline-block'}
-                ),
-                html.P(config["description"]),
-                html.Div([
-                    dbc.Row(
-                        [
-                            dbc.Col(dcc.Graph(id=graph_id, figure=fig), width=12, lg=12)
-                        ],
-                    )
-                ], className="mb-3")
-            ],
-            id=block_id,
-            className='mx-lg-auto',
-            style=PLOT_STYLE
+class SiteData:
+    """
+    The data store of one site and the caches built from its data
+    """
+    def __init__(self, site_id):
+        self.site = sites.find(site_configs, site_id)
+        self.id = self.site['id']
+        # Versioned data store, reloads changed TSV files on refresh()
+        # (set WW_SHARED_STORE_DIR, e.g. to /dev/shm/wastewater_qpcr, to share one memory-mapped copy between workers)
+        shared_dir = os.environ.get('WW_SHARED_STORE_DIR')
+        if shared_dir and self.id != site_configs[0]['id']:
+            shared_dir = os.path.join(shared_dir, 'sites', self.id)
+        self.store = DataStore(sites.site_layout(layout_config, self.site), shared_dir=shared_dir)
+        logging.info(f"Loading site {self.id}")
+        self.store.load()
+        sites.update_manifest(manifest_file, self.site, self.store)
+
+        # Serialized figures of the current data, rebuilt only when an entry's version changes
+        self.figure_cache = FigureCache(
+            lambda idx, df: update_figure(downsample.downsample_frame(df, MAX_POINTS_PER_TRACE), layout_config[idx],
+                                          entry_events(idx, df, self.store.derived))
         )
+        # Windowed statistics of the current data, shared by the AI summary, the sidebar and /api/stats
+        self.stats_cache = series_stats.VersionedCache(stage='stats')
+        # Spikes and new detections of the current data, computed once per data version
+        self.event_cache = series_stats.VersionedCache(lambda frames: detect_events(frames, self.store.derived),
+                                                       stage='anomalies')
+        # Mann-Kendall trends of the current data, computed once per data version
+        self.trend_cache = series_stats.VersionedCache(lambda frames: trends.compute_trends(frames, layout_config),
+                                                       stage='trends')
+        # Date-indexed matrix of all series and fractions for the comparison view, and the
+        # lag correlations between its columns, built once per data version
+        self.matrix_cache = series_stats.VersionedCache(compare.build_matrix, stage='matrix')
+        self.lag_cache = series_stats.VersionedCache(compare.lag_table, stage='lags')
+
+    def refresh(self):
+        # Pick up changed data files, returns the reloaded entries
+        changed = self.store.refresh()
+        if changed:
+            sites.update_manifest(manifest_file, self.site, self.store)
+        return changed
+
+    def figure(self, idx):
+        df, version = self.store.get(idx)
+        return self.figure_cache.get(idx, version, df)
+
+    def stats(self):
+        return self.stats_cache.get(*self.store.snapshot())
+
+    def events(self):
+        return self.event_cache.get(*self.store.snapshot())
+
+    def trends(self):
+        return self.trend_cache.get(*self.store.snapshot())
+
+    def comparison(self):
+        # (matrix, lag table) of the same data version
+        frames, data_version = self.store.snapshot()
+        matrix = self.matrix_cache.get(frames, data_version)
+        return matrix, self.lag_cache.get(matrix, data_version)
+
+# Sites are loaded on first use and unloaded beyond WW_MAX_SITES (least recently used),
+# the default site (the first one in layout.json) stays loaded
+site_cache = sites.SiteCache(SiteData, maxsize=int(os.environ.get('WW_MAX_SITES', 4)),
+                             pinned=[site_configs[0]['id']])
+
+def get_site(site_id=None):
+    """
+    Loaded data of a site, the default site for None or an unknown id
+    """
+    if sites.find(site_configs, site_id) is None:
+        logging.warning(f"Unknown site {site_id}, using the default site")
+        site_id = None
+    return site_cache.get(sites.find(site_configs, site_id)['id'])
+
+# The default site is loaded at startup, its entries are the charts of the page
+default_site = get_site()
+store = default_site.store
+figure_cache = default_site.figure_cache
+
+def get_figure(idx, site_id=None):
+    return get_site(site_id).figure(idx)
+
+def get_stats(site_id=None):
+    return get_site(site_id).stats()
+
+def get_events(site_id=None):
+    return get_site(site_id).events()
+
+def get_trends(site_id=None):
+    return get_site(site_id).trends()
+
+def request_site(site_id=None):
+    """
+    Site of an API request (the `site` query parameter by default), answers 404 if unknown
+    """
+    site_id = site_id if site_id is not None else flask.request.args.get('site')
+    if site_id is not None and sites.find(site_configs, site_id) is None:
+        flask.abort(flask.make_response({'error': f"Unknown site {site_id}"}, 404))
+    return get_site(site_id)
+
+@dash.get_app().server.route('/api/sites')
+def sites_endpoint():
+    # index of the sites: the series, date ranges and versions recorded in the manifest
+    # (kept current for the loaded sites), without loading any site
+    manifest = sites.read_manifest(manifest_file)
+    loaded = site_cache.loaded()
+    return {'sites': [{'id': site['id'], 'name': site['name'], 'loaded': site['id'] in loaded,
+                       **manifest['sites'].get(site['id'], {})} for site in site_configs]}
+
+@dash.get_app().server.route('/api/stats')
+def stats_endpoint():
+    site = request_site()
+    frames, data_version = site.store.snapshot()
+    records = series_stats.to_records(site.stats_cache.get(frames, data_version))
+    for record in records:
+        config = layout_config[record['series']]
+        record.update(pathogen=config['pathogen'], title=config['title'])
+    return {'data_version': data_version, 'stats': records}
+
+@dash.get_app().server.route('/api/events')
+def events_endpoint():
+    # spikes and new detections of the last anomalies.EVENT_DAYS days of every series
+    site = request_site()
+    frames, data_version = site.store.snapshot()
+    records = series_stats.to_records(site.event_cache.get(frames, data_version))
+    for record in records:
+        config = layout_config[record['series']]
+        record.update(pathogen=config['pathogen'], title=config['title'])
+    return {'data_version': data_version, 'alert_days': anomalies.ALERT_DAYS, 'events': records}
+
+@dash.get_app().server.route('/api/correlations')
+def correlations_endpoint():
+    # lag correlations between every pair of series and fractions, see compare.py
+    site = request_site()
+    frames, data_version = site.store.snapshot()
+    _, lags = site.comparison()
+    try:
+        series = [int(idx) for idx in data_api.query_list(flask.request.args, 'series')]
+    except ValueError:
+        return {'error': "series must be layout entry indexes"}, 400
+    if series:
+        lags = lags[lags['series_a'].isin(series) & lags['series_b'].isin(series)]
+    records = series_stats.to_records(lags)
+    for record in records:
+        record.update(pathogen_a=layout_config[record['series_a']]['pathogen'],
+                      pathogen_b=layout_config[record['series_b']]['pathogen'])
+    return {'data_version': data_version, 'max_lag_weeks': compare.MAX_LAG_WEEKS, 'correlations': records}
+
+@dash.get_app().server.route('/api/figure/<int:idx>')
+def figure_endpoint(idx):
+    # figure JSON of a series, revalidated with its data version as ETag
+    site = request_site()
+    if idx not in site.store.data_frames:
+        return {'error': f"Unknown series {idx}"}, 404
+    df, version = site.store.get(idx)
+    etag = f"{site.id}-{idx}-{version}"
+    if flask.request.if_none_match.contains_weak(etag):
+        response = flask.Response(status=304)
+    else:
+        response = flask.Response(site.figure_cache.get_json(idx, version, df), mimetype='application/json')
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@dash.get_app().server.route('/api/image/<int:idx>/<version>/<int:width>.<fmt>')
+def image_endpoint(idx, version, width, fmt):
+    # resized variant of the analysis image of a trend card, see images.py
+    path = layout_config[idx].get('analysis', {}).get('figure') if idx < len(layout_config) else None
+    if not images.available() or not path or not os.path.exists(path) or fmt not in images.FORMATS:
+        return {'error': f"No image variants of series {idx}"}, 404
+    info = images.source_info(path)
+    if width not in images.widths(info):
+        return {'error': f"width must be one of {images.widths(info)}"}, 404
+    if version != info['hash']:
+        # the image changed since the page was loaded
+        return flask.redirect(image_url(idx, info).format(width=width, fmt=fmt))
+    response = flask.send_file(os.path.abspath(images.variant(path, width, fmt)), mimetype=images.FORMATS[fmt],
+                               etag=f"{version}-{width}")
+    # the URL changes with the image
+    response.headers['Cache-Control'] = f'public, max-age={images.MAX_AGE}, immutable'
+    return response.make_conditional(flask.request)
+
+@dash.get_app().server.route('/api/series')
+def series_endpoint():
+    # catalog of the entries served by /api/data
+    site = request_site()
+    frames, data_version = site.store.snapshot()
+    series = sites.series_catalog(frames, {idx: site.store.version(idx) for idx in frames}, layout_config)
+    return {'site': site.id, 'data_version': data_version, 'series': series}
+
+@dash.get_app().server.route('/api/data')
+def data_endpoint():
+    """
+    Processed rows of the selected series as JSON, CSV or Parquet, see data_api.py
+    """
+    try:
+        query = data_api.parse_query(flask.request.args, layout_config)
+    except ValueError as err:
+        return {'error': str(err)}, 400
+    engine = data_api.parquet_engine() if query['format'] == 'parquet' else None
+    if query['format'] == 'parquet' and engine is None:
+        return {'error': "Parquet output needs pyarrow or fastparquet on the server, use format=csv or json"}, 501
+
+    site = request_site()
+    frames, data_version = site.store.snapshot()
+    indexes = data_api.selected_series(query, frames, layout_config)
+    # rows are only selected and serialized while the response is streamed (not at all for a 304)
+    parts = ((idx, data_api.select_rows(frames[idx], query), layout_config[idx]['pathogen']) for idx in indexes)
+    if query['format'] == 'csv':
+        body = data_api.stream_csv(parts)
+    elif query['format'] == 'json':
+        body = data_api.stream_json(parts, {'data_version': data_version, 'series': indexes})
+    else:
+        body = data_api.stream_parquet(parts, engine)
+
+    response = flask.Response(flask.stream_with_context(body), mimetype=data_api.FORMATS[query['format']])
+    if query['format'] != 'json':
+        response.headers['Content-Disposition'] = f'attachment; filename="wastewater-{site.id}.{query["format"]}"'
+    response.set_etag(data_api.etag(query, data_version), weak=True)
+    response.last_modified = data_api.http_date(site.store.latest_mtime(indexes))
+    response.headers['Cache-Control'] = 'public, no-cache'
+    # otherwise make_conditional() reads the whole stream to set Content-Length
+    response.direct_passthrough = True
+    return response.make_conditional(flask.request)
+
+@dash.get_app().server.route('/metrics')
+def metrics_endpoint():
+    # latency histograms and counters of this worker in the Prometheus text format
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+@dash.get_app().server.route('/api/ingest', methods=['POST'])
+def ingest_endpoint():
+    """
+    Append new measurements to a series, e.g.
+    {"series": 0, "rows": [{"date": "2025-10-24", "fraction": "F1", "value": 1.2e6, "std": 3e5}]}
+    with an "Authorization: Bearer <WW_INGEST_TOKEN>" header ("site" selects a site, the default one if not given)
+    """
+    token = os.environ.get('WW_INGEST_TOKEN')
+    if not token:
+        return {'error': "Ingest is disabled, set WW_INGEST_TOKEN to enable it"}, 403
+    supplied = flask.request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    if not hmac.compare_digest(supplied.encode(), token.encode()):
+        return {'error': "Unauthorized"}, 401
+
+    body = flask.request.get_json(silent=True) or {}
+    site = request_site(body.get('site'))
+    series = body.get('series')
+    if not isinstance(series, int) or series not in site.store.data_frames:
+        return {'error': f"Unknown series {series}"}, 404
+    try:
+        rows = ingest.parse_rows(body.get('rows'))
+        version = site.store.append(series, rows)
+    except ValueError as err:
+        return {'error': str(err)}, 400
+    metrics.inc('ingest_rows_total', len(rows))
+    return {'series': series, 'version': version, 'rows': len(rows)}
+
+# Charts are built for the entries that loaded at startup in the default site
+chart_indexes = list(store.data_frames)
+
+def placeholder_figure(text="Loading chart...", height=700):
+    # Figure of a chart until its cached figure is fetched from /api/figure/<idx>,
+    # sized like the real figure so that the page does not jump
+    return {
+        'data': [],
+        'layout': {
+            'height': height,
+            'xaxis': {'visible': False},
+            'yaxis': {'visible': False},
+            'annotations': [{'text': text, 'showarrow': False,
+                             'xref': 'paper', 'yref': 'paper', 'x': 0.5, 'y': 0.5}],
+        },
+    }
+
+def column_label(idx, fraction):
+    # Pathogen and fraction of a matrix column, and the operation of a derived series
+    config = layout_config[idx]
+    label = f"{config['pathogen']} {fraction}"
+    if 'derived' in config:
+        label += f" ({config['derived']['op'].replace('_', ' ')})"
+    return label
+
+def compare_options(matrix):
+    return [{'label': column_label(idx, fraction), 'value': compare.column_key(idx, fraction)}
+            for idx, fraction in matrix.columns]
+
+def default_comparison(matrix):
+    # The first fraction of every pathogen's first data series
+    keys, pathogens = [], set()
+    for idx, fraction in matrix.columns:
+        pathogen = layout_config[idx]['pathogen']
+        if pathogen not in pathogens and 'derived' not in layout_config[idx]:
+            pathogens.add(pathogen)
+            keys.append(compare.column_key(idx, fraction))
+    return keys
+
+def comparison_figure(matrix, keys, how):
+    # imported on first use like plotly.express
+    import plotly.graph_objects as go
+
+    values = compare.scale(compare.select(matrix, keys), how)
+    fig = go.Figure()
+    for (idx, fraction), column in values.items():
+        column = column.dropna()
+        x, y = column.index.to_numpy(), column.to_numpy()
+        if len(column) > MAX_POINTS_PER_TRACE:
+            keep = downsample.lttb(x.astype('datetime64[ms]').astype('float64'), y, MAX_POINTS_PER_TRACE)
+            x, y = x[keep], y[keep]
+        fig.add_trace(go.Scatter(x=x, y=y, name=column_label(idx, fraction), mode="markers+lines",
+                                 marker=dict(size=4)))
+    fig.update_layout(template='ggplot2', height=500, hovermode="x unified", uirevision=how,
+                      yaxis_title=compare.SCALES[how], xaxis_title="Date",
+                      legend=dict(orientation="h", yanchor="bottom", y=1.02, x=0))
+    fig.update_xaxes(type="date", rangeslider=dict(visible=True, thickness=0.1))
+    if how == 'log':
+        fig.update_yaxes(type="log")
+    return payload.encode_figure(fig)
+
+def lag_text(lag):
+    if lag is None or pd.isna(lag):
+        return "-"
+    if lag == 0:
+        return "same week"
+    return f"B follows by {int(lag)} wk" if lag > 0 else f"B leads by {-int(lag)} wk"
+
+def comparison_table(lags, keys):
+    # Correlations of the weekly log values of the selected columns, strongest first
+    rows = compare.pair_rows(lags, keys).sort_values('best_corr', ascending=False, na_position='last')
+    if not len(rows):
+        return html.P("Select at least two series to compare their trends.", style={"font-size": "0.8rem"})
+    header = ["A", "B", "r", "Best lag", "r at best lag", "Weeks"]
+    body = [
+        html.Tr([
+            html.Td(column_label(row.series_a, row.fraction_a)),
+            html.Td(column_label(row.series_b, row.fraction_b)),
+            html.Td("-" if pd.isna(row.corr) else f"{row.corr:.2f}"),
+            html.Td(lag_text(row.best_lag_weeks)),
+            html.Td("-" if pd.isna(row.best_corr) else f"{row.best_corr:.2f}"),
+            html.Td(int(row.best_weeks)),
+        ])
+        for row in rows.itertuples()
+    ]
+    return html.Div([
+        dbc.Table([html.Thead(html.Tr([html.Th(text) for text in header])), html.Tbody(body)],
+                  size="sm", striped=True, style={"font-size": "0.8rem"}),
+        html.P(f"Pearson correlation of the weekly mean log values, with B shifted by up to "
+               f"{compare.MAX_LAG_WEEKS} weeks; pairs with fewer than {compare.MIN_OVERLAP_WEEKS} weeks "
+               f"in common are left out.", style={"font-size": "0.8rem", "color": "gray"}),
+    ])
+
+def build_compare_card(site):
+    # Hidden until the Compare button is clicked, the figure is built then
+    matrix, _ = site.comparison()
+    return dbc.Card(
+        dbc.CardBody([
+            html.H4("Compare pathogens"),
+            dbc.Row([
+                dbc.Col(dcc.Dropdown(id="compare-columns-id", options=compare_options(matrix),
+                                     value=default_comparison(matrix), multi=True), md=9),
+                dbc.Col(dbc.RadioItems(id="compare-scale-id", value='normalized', inline=True,
+                                       options=[{'label': label, 'value': how} for how, label in compare.SCALES.items()]),
+                        md=3),
+            ], align="center"),
+            dcc.Graph(id="compare-graph-id", figure=placeholder_figure("Loading...", height=500)),
+            html.Div(id="compare-lags-id"),
+        ]),
+        id="compare-card",
+        className="mb-4 mt-4",
+        style={"display": "none"}
     )
 
+def build_chart_blocks(site):
+    # The blocks start with a placeholder, the figure is fetched (assets/clientside.js)
+    # when the block is scrolled into view or its pathogen is selected, so the page
+    # layout does not grow with the number of charts
+    viz_layout_children = []
+    for idx in chart_indexes:
+        config = layout_config[idx]
+        if idx in site.store.data_frames:
+            figure = placeholder_figure()
+            source = {'data-figure-src': dash.get_relative_path(f"/api/figure/{idx}") + f"?site={site.id}"}
+        else:
+            # the site has no data files for this entry
+            figure, source = placeholder_figure("No data for this site"), {}
+
+        # Build graph block
+        block_id = f"chart{idx+1}-block-id"
+        graph_id = f"chart{idx+1}-graph-id"
+
+        logging.debug(f"Appending plot: {config['title']}")
+
+        viz_layout_children.append(
+            html.Div(
+                [
+                    html.H4(
+                        config["title"],
+                        className="mr-3",
+                        style={'display':'inline-block'}
+                    ),
+                    html.P(config["description"]),
+                    html.Div([
+                        dbc.Row(
+                            [
+                                dbc.Col(dcc.Graph(id=graph_id, figure=figure), width=12, lg=12)
+                            ],
+                        )
+                    ], className="mb-3")
+                ],
+                id=block_id,
+                className='mx-lg-auto',
+                style=PLOT_STYLE,
+                **{
+                    **source,
+                    'data-graph-id': graph_id,
+                    'data-pathogen': config['pathogen'],
+                }
+            )
+        )
+    return viz_layout_children
+
+def warm_caches():
+    # Build the figures, statistics and trends of the current data of the default site
+    for idx in chart_indexes:
+        get_figure(idx)
+    get_stats()
+    get_trends()
+    get_events()
+
+# Figures, statistics and trends are built on first use. Set WW_WARM_CACHES=1 to
+# build them at import instead, e.g. with gunicorn --preload so that the forked
+# workers start with them
+if os.environ.get('WW_WARM_CACHES', '0') == '1':
+    warm_caches()
+
 # ---------------------------
 # Create Trend Cards (Left Sidebar)
 # ---------------------------
 # Define mapping of trend to Bootstrap badge color:
 trend_badge_color = {"increasing": "danger", "decreasing": "success", "stable": "warning"}
 
-trend_cards = []
-for idx, config in enumerate(layout_config):
-    if 'analysis' in config:
-        # determine badge color based on trend
-        badge_color = "warning"
+def format_value(value):
+    # Human-readable abbreviated form of large numbers (e.g. 3,453,358 to 3.5M)
+    for threshold, suffix in [(1e9, 'B'), (1e6, 'M'), (1e3, 'K')]:
+        if abs(value) >= threshold:
+            return f"{value / threshold:.1f}{suffix}"
+    return f"{value:.3g}"
 
-        for trend_text in trend_badge_color:
-            if trend_text in config['analysis']['trend']:
-                badge_color = trend_badge_color[trend_text]
-                break
+def build_trend_cards(stats, trend_table, events):
+    trend_cards = []
+    for idx, config in enumerate(layout_config):
+        if 'analysis' in config:
+            # Trend computed from the data, the hand-written one is only a fallback
+            trend, trend_rows = trends.series_trend(trend_table, idx)
+            trend_details = []
+            if trend == 'insufficient data':
+                trend = config['analysis']['trend']
+            else:
+                details = "; ".join(
+                    f"{row.Fraction}: {row.trend}" + ("" if row.trend == 'insufficient data'
+                                                     else f" (p={row.p:.2f}, {format_value(row.slope_per_day)}/day)")
+                    for row in trend_rows.itertuples()
+                )
+                trend_details = [html.P(f"Mann-Kendall, last {trend_rows['window_days'].iloc[0]} days: {details}",
+                                        style={"font-size": "0.8rem"})]
 
-        # Use dbc.Badge to display the trend with a colored background
-        trend_badge = dbc.Badge(f"Trend: {config['analysis']['trend']}", color=badge_color, className="ms-1")
+            # determine badge color based on trend
+            badge_color = "warning"
 
-        card = dbc.Card(
-            dbc.CardBody(
-                [
-                    html.H6(config["pathogen"], className="card-title"),
-                    html.P(trend_badge),
-                    html.P(config['analysis']['description'], style={"font-size": "0.8rem"}),
-                    dbc.CardLink("Click here for more details...", 
-                                 id=f"trend-figure-link{idx+1}",
-                                 href="#", 
-                                 style={"font-size": "0.8rem", "color": "gray"})
-                ]
-            ),
-            className="mb-3 trend-card",
-            style={},
-            id=f"trend-card{idx+1}"
-        )
-        trend_cards.append(card)
-    else:
-        continue
+            for trend_text in trend_badge_color:
+                if trend_text in trend:
+                    badge_color = trend_badge_color[trend_text]
+                    break
+
+            # Use dbc.Badge to display the trend with a colored background
+            trend_badge = dbc.Badge(f"Trend: {trend}", color=badge_color, className="ms-1")
+
+            # Alerts: spikes and new detections of the last days
+            alert_rows = anomalies.series_events(events, idx, anomalies.ALERT_DAYS)
+            alert_badges, alert_details = [], []
+            for event, color in [('spike', "danger"), ('new_detection', "info")]:
+                count = int((alert_rows['event'] == event).sum())
+                if count:
+                    label = anomalies.EVENT_LABELS[event].capitalize()
+                    alert_badges.append(dbc.Badge(label + (f" x{count}" if count > 1 else ""), color=color, className="ms-1"))
+            if len(alert_rows):
+                alert_details = [html.P("Alerts: " + "; ".join(anomalies.describe(row) for row in alert_rows.itertuples()),
+                                        style={"font-size": "0.8rem"})]
+
+            # Latest values from the statistics table
+            rows = series_stats.series_stats(stats, idx)
+            rows = rows[rows['latest_value'].notna()]
+            latest = []
+            if len(rows):
+                latest_values = ", ".join(f"{row.Fraction} {format_value(row.latest_value)}" for row in rows.itertuples())
+                latest = [html.P(f"Latest ({rows['latest_date'].iloc[0]:%Y-%m-%d}): {latest_values}",
+                                 style={"font-size": "0.8rem"})]
+
+            card = dbc.Card(
+                dbc.CardBody(
+                    [
+                        html.H6(config["pathogen"], className="card-title"),
+                        html.P([trend_badge, *alert_badges]),
+                        html.P(config['analysis']['description'], style={"font-size": "0.8rem"}),
+                        *latest,
+                        *alert_details,
+                        *trend_details,
+                        dbc.CardLink("Click here for more details...", 
+                                     id=f"trend-figure-link{idx+1}",
+                                     href="#", 
+                                     style={"font-size": "0.8rem", "color": "gray"})
+                    ]
+                ),
+                className="mb-3 trend-card",
+                style={},
+                id=f"trend-card{idx+1}"
+            )
+            trend_cards.append(card)
+        else:
+            continue
+    return trend_cards
+
+def image_url(idx, info):
+    return dash.get_relative_path(f"/api/image/{idx}/{info['hash']}/") + "{width}.{fmt}"
+
+def image_sources(idx):
+    """
+    src, WebP and PNG srcset and size of the analysis image of a trend card,
+    None when it is served as is (no Pillow, or missing)
+    """
+    path = layout_config[idx].get('analysis', {}).get('figure')
+    if not images.available() or not path or not os.path.exists(path):
+        return None
+    info = images.source_info(path)
+    url = image_url(idx, info)
+    return {
+        'src': url.format(width=images.default_width(info), fmt='png'),
+        'webp': images.srcset(url, info, 'webp'),
+        'png': images.srcset(url, info, 'png'),
+        'sizes': images.SIZES,
+        'width': info['width'],
+        'height': info['height'],
+    }
+
+def analysis_image(idx):
+    # Picture of the variants sized for the screen, WebP where supported
+    config = layout_config[idx]
+    style = {"width": "100%", "height": "auto"}
+    sources = image_sources(idx)
+    if sources is None:
+        return html.Img(src=config['analysis']['figure'], alt=config['pathogen'], style=style)
+    return html.Picture([
+        html.Source(type=images.FORMATS['webp'], srcSet=sources['webp'], sizes=sources['sizes']),
+        html.Img(src=sources['src'], srcSet=sources['png'], sizes=sources['sizes'], alt=config['pathogen'],
+                 width=sources['width'], height=sources['height'], style=style),
+    ])
+
+def trend_image_sources():
+    # Images of the trend cards, preloaded by the page in the background
+    return [sources for sources in (image_sources(idx) for idx, config in enumerate(layout_config) if 'analysis' in config)
+            if sources is not None]
 
 modal = html.Div(
     [
@@ -347,7 +955,7 @@ modal = html.Div(
 
 options = [{'label': 'all pathogens', 'value': 'all pathogens'}]
 pathnames = []
-for idx in data_frames:
+for idx in chart_indexes:
     config = layout_config[idx]
     path_val = config['pathogen']
     if path_val not in pathnames:
@@ -373,63 +981,87 @@ summary_button = dbc.Button(
     outline=True
 )
 
-navbar = dbc.Navbar(
-    dbc.Container(
-        [
-            html.A(
-                dbc.Row(
-                    [
-                        dbc.Col([
-                            html.Span([
-                                html.I(className="fa-solid fa-droplet"),
-                            ],
-                            className="me-2",
-                            style={"font-size": "1.1rem", "color": "white"}
-                            ),
-                            dbc.NavbarBrand("LANL Wastewater", className="ml-1")
-                        ]),
-                    ],
-                    align="center",
-                ),
-                href="/",
-                className="text-decoration-none"
-            ),
-            dbc.NavbarToggler(id="navbar-toggler", n_clicks=0),
-            dbc.Collapse(
-                dbc.Row(
-                    [
-                        dbc.Col(dropdown, className="me-2"),
-                        dbc.Col(summary_button, width="auto")
-                    ],
-                    className="ms-auto flex-nowrap mt-3 mt-md-0",
-                    align="center"
-                ),
-                id="navbar-collapse",
-                is_open=False,
-                navbar=True,
-            )
-        ]
-    ),
-    color="dark",
-    dark=True,
-    className='fixed-top container-fluid',
+compare_button = dbc.Button(
+    "Compare",
+    id="compare-btn",
+    color="light",
+    className="ms-2",
+    size="sm",
+    outline=True
 )
 
+def site_dropdown(site):
+    # Site menu, only shown when layout.json declares several sites
+    if len(site_configs) < 2:
+        return []
+    return [dbc.Col(dcc.Dropdown(
+        id="site-menu-id",
+        options=[{'label': config['name'], 'value': config['id']} for config in site_configs],
+        value=site.id,
+        clearable=False,
+    ), className="me-2")]
+
+def build_navbar(site):
+    return dbc.Navbar(
+        dbc.Container(
+            [
+                html.A(
+                    dbc.Row(
+                        [
+                            dbc.Col([
+                                html.Span([
+                                    html.I(className="fa-solid fa-droplet"),
+                                ],
+                                className="me-2",
+                                style={"font-size": "1.1rem", "color": "white"}
+                                ),
+                                dbc.NavbarBrand("LANL Wastewater", className="ml-1")
+                            ]),
+                        ],
+                        align="center",
+                    ),
+                    href="/",
+                    className="text-decoration-none"
+                ),
+                dbc.NavbarToggler(id="navbar-toggler", n_clicks=0),
+                dbc.Collapse(
+                    dbc.Row(
+                        [
+                            *site_dropdown(site),
+                            dbc.Col(dropdown, className="me-2"),
+                            dbc.Col(compare_button, width="auto"),
+                            dbc.Col(summary_button, width="auto")
+                        ],
+                        className="ms-auto flex-nowrap mt-3 mt-md-0",
+                        align="center"
+                    ),
+                    id="navbar-collapse",
+                    is_open=False,
+                    navbar=True,
+                )
+            ]
+        ),
+        color="dark",
+        dark=True,
+        className='fixed-top container-fluid',
+    )
+
 
 # ---------------------------
 # Define the Overall Layout with Two Columns
 # ---------------------------
 
-sidebar = html.Div(
-    trend_cards+[html.Div(html.Span("test...", id='update-time-id'))],
-    style=SIDEBAR_STYLE)
+def build_sidebar(site):
+    return html.Div(
+        build_trend_cards(site.stats(), site.trends(), site.events())+[html.Div(html.Span("test...", id='update-time-id'))],
+        style=SIDEBAR_STYLE)
 
 # Create AI summary card component - initially hidden
 ai_summary_card = dbc.Card(
     [
         dbc.CardBody(
             [
-                html.P("", id="ai-summary-text"),
+                dcc.Markdown("", id="ai-summary-text"),
                 dbc.Spinner(color="secondary", type="grow", size="sm", id="ai-summary-loading"),
                 html.Span(f"Generated by LANL AI portal: {modal_name}", style={"font-size": "0.8rem"}),
             ],
@@ -441,142 +1073,344 @@ ai_summary_card = dbc.Card(
     style={"display": "none"}
 )
 
-# Add the AI summary card to the main content
-main_content = html.Div([
-    ai_summary_card,
-    html.Div(viz_layout_children)
-], style=CONTENT_STYLE)
-
-layout = dbc.Container([
-    dcc.Location(id='url', refresh='callback-nav'),
-    modal,
-    navbar,
-    sidebar,
-    main_content
-    # dbc.Row([
-    #     dbc.Col(
-    #         sidebar,
-    #         xs=12, md=3, lg=2,  # Responsive widths
-    #         # style={"marginTop": "5rem", "paddingLeft": "2rem"}
-    #     ),
-    #     dbc.Col(
-    #         main_content,
-    #         xs=12, md=9, lg=10,  # Responsive widths
-    #         # style={"marginTop": "5rem"}
-    #     )
-    # ])
-], fluid=True)
+# Interval to poll the data store for changed or appended data (every WW_POLL_INTERVAL seconds)
+refresh_interval = dcc.Interval(id="data-refresh-interval", interval=int(os.environ.get('WW_POLL_INTERVAL', 15))*1000)
+
+# AI summary jobs run in the background, the page polls for the result
+summary_jobs = SummaryJobs(os.environ.get('WW_SUMMARY_CACHE_DIR', '.cache/ai_summary'))
+ai_summary_poll = html.Div([
+    dcc.Store(id="ai-summary-job"),
+    dcc.Interval(id="ai-summary-poll", interval=500, disabled=True),
+])
+
+@metrics.timed_callback
+def layout(site=None, **kwargs):
+    # Built on every page load so that new visitors get the current figures,
+    # of the site given in the URL (/?site=<id>), loaded on its first visit
+    site = get_site(site)
+
+    # Add the AI summary card to the main content
+    main_content = html.Div([
+        ai_summary_card,
+        build_compare_card(site),
+        html.Div(build_chart_blocks(site))
+    ], style=CONTENT_STYLE)
+
+    return dbc.Container([
+        dcc.Location(id='url', refresh='callback-nav'),
+        dcc.Store(id='site-id', data=site.id),
+        dcc.Store(id='data-version-id', data=site.store.versions()),
+        dcc.Store(id='data-append-id'),
+        dcc.Store(id='block-pathogens-id', data=[pathogen for _, pathogen in filter_outputs]),
+        dcc.Store(id='chart-loader-id'),
+        dcc.Store(id='trend-images-id', data=trend_image_sources()),
+        dcc.Store(id='image-preload-id'),
+        refresh_interval,
+        ai_summary_poll,
+        modal,
+        build_navbar(site),
+        build_sidebar(site),
+        main_content
+        # dbc.Row([
+        #     dbc.Col(
+        #         sidebar,
+        #         xs=12, md=3, lg=2,  # Responsive widths
+        #         # style={"marginTop": "5rem", "paddingLeft": "2rem"}
+        #     ),
+        #     dbc.Col(
+        #         main_content,
+        #         xs=12, md=9, lg=10,  # Responsive widths
+        #         # style={"marginTop": "5rem"}
+        #     )
+        # ])
+    ], fluid=True)
 
 # ---------------------------
 # Callbacks
 # ---------------------------
 
-# Callback to initialize chart dropdowns and update block display based on pathogen selection
-@callback(
-    *[Output(f"trend-card{idx+1}", 'style') for idx in range(len(layout_config)) if 'analysis' in layout_config[idx]],
-    *[Output(f"chart{idx+1}-block-id", 'style') for idx in data_frames],
+# Pathogen of each trend card and chart block, in the output order of the filter callback
+filter_outputs = (
+    [(f"trend-card{idx+1}", layout_config[idx]['pathogen']) for idx in range(len(layout_config)) if 'analysis' in layout_config[idx]] +
+    [(f"chart{idx+1}-block-id", layout_config[idx]['pathogen']) for idx in chart_indexes]
+)
+
+# Clientside callback to update block display based on pathogen selection (assets/clientside.js)
+clientside_callback(
+    ClientsideFunction(namespace='wastewater', function_name='filter_pathogen'),
+    *[Output(block_id, 'style') for block_id, _ in filter_outputs],
     Input('pathogen-menu-id', 'value'),
+    State('block-pathogens-id', 'data'),
+    *[State(block_id, 'style') for block_id, _ in filter_outputs],
     prevent_initial_call=True
 )
-def init_page(pathogen):
-    global data_frames, layout_config
-    graphs = []
-    show_blocks = []
-
-    for idx in range(len(layout_config)):
-        if 'analysis' in layout_config[idx]:
-            config = layout_config[idx]
-            style_patch = Patch()
-            if pathogen == 'all pathogens' or pathogen == config['pathogen'] or not pathogen:
-                style_patch["display"] = "block"
-                show_blocks.append(style_patch)
-            else:
-                style_patch["display"] = "none"
-                show_blocks.append(style_patch)
 
-    for idx in data_frames:
-        config = layout_config[idx]
+# Clientside callback to start fetching the figures of the chart blocks in view
+clientside_callback(
+    ClientsideFunction(namespace='wastewater', function_name='observe_charts'),
+    Output('chart-loader-id', 'data'),
+    Input('block-pathogens-id', 'data'),
+)
 
-        style_patch = Patch()
-        if pathogen == 'all pathogens' or pathogen == config['pathogen'] or not pathogen:
-            style_patch["display"] = "block"
-            show_blocks.append(style_patch)
-            graphs.append(update_figure(data_frames[idx]))
-        else:
-            style_patch["display"] = "none"
-            show_blocks.append(style_patch)
-            graphs.append(no_update)
+# Clientside callback to preload the images of the trend cards once the page is idle
+clientside_callback(
+    ClientsideFunction(namespace='wastewater', function_name='preload_images'),
+    Output('image-preload-id', 'data'),
+    Input('trend-images-id', 'data'),
+)
+
+# Callback to open the page of the site selected in the site menu
+@callback(
+    Output('url', 'search'),
+    Input('site-menu-id', 'value'),
+    State('site-id', 'data'),
+    prevent_initial_call=True
+)
+def select_site(site_id, current_site):
+    if not site_id or site_id == current_site:
+        return no_update
+    return f"?site={site_id}"
 
-    return show_blocks
+mt_timezone = pytz.timezone('America/Denver')
 
 # Callback to update time stamp
 @callback(
     Output('update-time-id', 'children'),
     Input('pathogen-menu-id', 'value'),
+    State('site-id', 'data'),
 )
-def update_time(pathogen):
+@metrics.timed_callback
+def update_time(pathogen, site_id):
+    # Pick up any data files changed since the last check
+    site = get_site(site_id)
+    site.refresh()
+
     # Determine the latest update time across all data files
-    latest_time = 0
-    for file in check_files:
-        if file and os.path.exists(file):
-            ti = os.path.getmtime(file)
-            if ti > latest_time:
-                latest_time = ti
+    latest_time = site.store.latest_mtime()
     
     if latest_time:
-        import pytz
-        from datetime import timezone, datetime
         utc_dt = datetime.fromtimestamp(latest_time, tz=timezone.utc)
-        mt_timezone = pytz.timezone('America/Denver')
         time_stamp = "Last updated: " + utc_dt.astimezone(mt_timezone).strftime('%Y-%m-%d %H:%M')
     else:
         time_stamp = "Unknown"
 
     return time_stamp
 
+def appended_traces(store, idx, client_version):
+    """
+    Points appended to an entry of a store since the client's version, per
+    figure trace, or None if the client needs the whole figure
+    """
+    rows = store.appended(idx, client_version)
+    if rows is None or not len(rows):
+        return None
+    df, _ = store.get(idx)
+    # update_figure() draws one trace per fraction, in order of appearance
+    fractions = list(pd.unique(df['Fraction']))
+    counts = df['Fraction'].value_counts()
+    if any(counts.get(fraction, 0) <= n for fraction, n in rows['Fraction'].value_counts().items()):
+        # a new fraction has no trace in the client's figure yet
+        return None
+
+    traces = []
+    for fraction, group in rows.groupby('Fraction', sort=False):
+        trace = {
+            'trace': fractions.index(fraction),
+            'x': payload.date_ms(group['Date']).tolist(),
+            'y': group['Value'].tolist(),
+        }
+        if 'Value_std' in df.columns:
+            # no error bar where no std was measured
+            trace['error_y'] = group['Value_std'].astype(object).where(group['Value_std'].notna(), None).tolist()
+        traces.append(trace)
+    return traces
 
-# add callback for toggling the collapse on small screens
+# Callback to push figures of reloaded data to open pages, appended points
+# are sent on their own and added to the figures clientside
 @callback(
+    *[Output(f"chart{idx+1}-graph-id", 'figure') for idx in chart_indexes],
+    Output('data-version-id', 'data'),
+    Output('data-append-id', 'data'),
+    Input('data-refresh-interval', 'n_intervals'),
+    State('data-version-id', 'data'),
+    State('site-id', 'data'),
+    prevent_initial_call=True
+)
+@metrics.timed_callback
+def refresh_figures(n_intervals, client_versions, site_id):
+    site = get_site(site_id)
+    site.refresh()
+    versions = site.store.versions()
+    client_versions = client_versions or {}
+
+    if versions == client_versions:
+        return [no_update] * (len(chart_indexes) + 2)
+
+    # Only the figures of the entries that changed are sent
+    graphs, appended = [], {}
+    for position, idx in enumerate(chart_indexes):
+        client_version = client_versions.get(str(idx))
+        if versions.get(str(idx)) == client_version:
+            graphs.append(no_update)
+            continue
+        traces = appended_traces(site.store, idx, client_version)
+        if traces is None:
+            graphs.append(site.figure(idx))
+        else:
+            graphs.append(no_update)
+            appended[str(position)] = traces
+
+    return *graphs, versions, (appended or no_update)
+
+clientside_callback(
+    ClientsideFunction(namespace='wastewater', function_name='extend_figures'),
+    *[Output(f"chart{idx+1}-graph-id", 'figure', allow_duplicate=True) for idx in chart_indexes],
+    Input('data-append-id', 'data'),
+    *[State(f"chart{idx+1}-graph-id", 'figure') for idx in chart_indexes],
+    prevent_initial_call=True
+)
+
+
+# Callbacks to swap in full-resolution points for the zoomed window of downsampled charts
+def zoom_figure_patch(idx, relayout_data, site_id=None):
+    site = get_site(site_id)
+    if idx not in site.store.data_frames:
+        return no_update
+    df, version = site.store.get(idx)
+    if not downsample.needs_downsampling(df, MAX_POINTS_PER_TRACE):
+        return no_update
+
+    window = downsample.relayout_window(relayout_data)
+    if window is None and not (relayout_data or {}).get('xaxis.autorange'):
+        return no_update
+
+    # window is None on reset, which restores the overview points
+    plot_data = downsample.downsample_frame(df, MAX_POINTS_PER_TRACE, window=window)
+    fig = site.figure(idx)
+
+    patch = Patch()
+    for i, trace in enumerate(fig['data']):
+        trace_data = plot_data[plot_data['Fraction'] == trace['name']]
+        patch['data'][i]['x'] = payload.typed_array(payload.date_ms(trace_data['Date']))
+        patch['data'][i]['y'] = payload.typed_array(trace_data['Value'])
+        if 'Value_std' in trace_data.columns and 'error_y' in trace:
+            patch['data'][i]['error_y']['array'] = payload.typed_array(trace_data['Value_std'])
+
+    return patch
+
+def make_zoom_callback(idx):
+    def zoom_figure(relayout_data, site_id):
+        return zoom_figure_patch(idx, relayout_data, site_id)
+    return zoom_figure
+
+for idx in chart_indexes:
+    callback(
+        Output(f"chart{idx+1}-graph-id", 'figure', allow_duplicate=True),
+        Input(f"chart{idx+1}-graph-id", 'relayoutData'),
+        State('site-id', 'data'),
+        prevent_initial_call=True
+    )(metrics.timed_callback(make_zoom_callback(idx), 'zoom_figure'))
+
+
+# add clientside callback for toggling the collapse on small screens
+clientside_callback(
+    ClientsideFunction(namespace='wastewater', function_name='toggle_navbar_collapse'),
     Output("navbar-collapse", "is_open"),
     [Input("navbar-toggler", "n_clicks")],
     [State("navbar-collapse", "is_open")],
 )
-def toggle_navbar_collapse(n, is_open):
-    if n:
-        return not is_open
-    return is_open
 
-# Callback for generating AI summary block visibility
+def run_ai_summary_job(selected_pathogen, site_id=None):
+    """
+    Submit (or look up) the AI summary job of the current data of a site, returns
+    the job key and its result if it is already available
+    """
+    site = get_site(site_id)
+    frames, data_version = site.store.snapshot()
+    key = SummaryJobs.key(selected_pathogen, f"{site.id}:{data_version}", f"{modal_name}:{summary_mode}")
+    stats = site.stats_cache.get(frames, data_version)
+    events = site.event_cache.get(frames, data_version)
+    return key, summary_jobs.submit(key, request_ai_summary, frames, selected_pathogen, modal_name, stats, events,
+                                    site.store.derived)
+
+# Callback for generating AI summary block visibility and starting the summary job
 @callback(
     Output("ai-summary-text", "children", allow_duplicate=True),
     Output("ai-summary-loading", "style", allow_duplicate=True),
     Output("ai-summary-card", "style"),
+    Output("ai-summary-job", "data"),
+    Output("ai-summary-poll", "disabled"),
     [Input("generate-ai-summary-btn", "n_clicks")],
+    [State("pathogen-menu-id", "value"), State("site-id", "data")],
     prevent_initial_call=True
 )
-def update_ai_summary_block(n_clicks):
+@metrics.timed_callback
+def update_ai_summary_block(n_clicks, selected_pathogen, site_id):
     if n_clicks:
-        return "", {"display": "block"}, {"display": "block"}
+        key, result = run_ai_summary_job(selected_pathogen, site_id)
+        if result is not None:
+            # cached summary of the current data
+            return result.get('summary', result.get('error')), {"display": "none"}, {"display": "block"}, None, True
+        return "", {"display": "block"}, {"display": "block"}, {"key": key, "pathogen": selected_pathogen, "site": site_id}, False
     return no_update
 
-# Callback for generating AI summary
+# Callback polling the running AI summary job
 @callback(
     Output("ai-summary-text", "children"),
     Output("ai-summary-loading", "style"),
-    [Input("ai-summary-loading", "style")],
-    [State("pathogen-menu-id", "value")],
+    Output("ai-summary-poll", "disabled", allow_duplicate=True),
+    [Input("ai-summary-poll", "n_intervals")],
+    [State("ai-summary-job", "data")],
     prevent_initial_call=True
 )
-def update_ai_summary_content(loading_style, selected_pathogen):
-    if loading_style == {"display": "block"}:        
-        # Generate summary
-        summary = generate_ai_summary(data_frames, selected_pathogen)
-        # Hide loading spinner but keep card visible
-        loading_style = {"display": "none"}
+@metrics.timed_callback
+def update_ai_summary_content(n_intervals, job):
+    if not job:
+        return no_update, no_update, True
+
+    result = summary_jobs.result(job['key'])
+    if result is None and not summary_jobs.is_running(job['key']):
+        # the worker running the job went away, start it again
+        result = run_ai_summary_job(job['pathogen'], job.get('site'))[1]
+    if result is None:
+        # the part of the answer streamed so far
+        partial = summary_jobs.partial(job['key'])
+        return (partial if partial else no_update), no_update, False
 
-        return summary, loading_style
+    # Hide loading spinner but keep card visible
+    return result.get('summary', result.get('error')), {"display": "none"}, True
 
-    return no_update, no_update
+# Callback to show or hide the comparison card
+@callback(
+    Output("compare-card", "style"),
+    Input("compare-btn", "n_clicks"),
+    State("compare-card", "style"),
+    prevent_initial_call=True
+)
+@metrics.timed_callback
+def toggle_compare(n_clicks, style):
+    shown = (style or {}).get("display") != "none"
+    return {**(style or {}), "display": "none" if shown else "block"}
+
+# Callback to draw the comparison of the selected series, from the matrix of the current data
+@callback(
+    Output("compare-graph-id", "figure"),
+    Output("compare-lags-id", "children"),
+    Input("compare-columns-id", "value"),
+    Input("compare-scale-id", "value"),
+    Input("compare-card", "style"),
+    Input("data-version-id", "data"),
+    State("site-id", "data"),
+    prevent_initial_call=True
+)
+@metrics.timed_callback
+def update_comparison(keys, how, style, versions, site_id):
+    if (style or {}).get("display") == "none":
+        # built when the card is shown
+        return no_update, no_update
+    matrix, lags = get_site(site_id).comparison()
+    keys = keys or []
+    return comparison_figure(matrix, keys, how), comparison_table(lags, keys)
 
 # Add callback to update modal content when trend card is clicked
 @callback(
@@ -589,6 +1423,7 @@ def update_ai_summary_content(loading_style, selected_pathogen):
     ],
     prevent_initial_call=True,
 )
+@metrics.timed_callback
 def toggle_modal(*n_clicks):
     # Get the ID of the card that was clicked
     triggered_id = ctx.triggered_id if ctx.triggered_id else None
@@ -611,8 +1446,7 @@ def toggle_modal(*n_clicks):
     modal_content = [
         dbc.ModalHeader(dbc.ModalTitle(f"{config.get('pathogen', 'Analysis')}"), close_button=True),
         dbc.ModalBody([
-            html.Img(src=config['analysis']['figure'], 
-                     style={"width": "100%", "height": "auto"}),
+            analysis_image(card_idx),
             html.P(config['analysis']['description'], 
                    className="mt-3")
         ]),
@@ -629,6 +1463,7 @@ def toggle_modal(*n_clicks):
     [Input("close-centered", "n_clicks")],
     prevent_initial_call=True
 )
+@metrics.timed_callback
 def close_modal(n_clicks):
     if n_clicks:
         return False
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+"""
+On-disk cache of processed data frames.
+
+Each layout entry is stored as one .npz file holding the columns of the
+already-processed long frame and a JSON header describing its source files
+(path, size, mtime and content hash). A cache file is valid when every
+source file still has the same size and mtime, or, failing that, the same
+content hash (e.g. when a data volume is mounted with new mtimes).
+
+Pre-warm the cache, e.g. at image build time:
+
+    python parse_cache.py [--layout assets/data/layout.json] [--cache-dir .cache/parse]
+"""
+import os
+import json
+import logging
+import hashlib
+import argparse
+
+import numpy as np
+import pandas as pd
+
+# Bump when process_data() or the layout of the cache files changes
+CACHE_FORMAT = 4
+
+cache_dir = os.environ.get('WW_PARSE_CACHE_DIR', '.cache/parse')
+
+
+def content_hash(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _cache_path(files):
+    key = hashlib.sha1('\0'.join(files).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{key}.npz")
+
+
+def _source_info(path, with_hash=True):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    info = {'path': path, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+    if with_hash:
+        info['sha1'] = content_hash(path)
+    return info
+
+
+def _is_valid(cached, path):
+    if cached is None:
+        return not os.path.exists(path)
+    current = _source_info(path, with_hash=False)
+    if current is None or current['size'] != cached['size']:
+        return False
+    if current['mtime_ns'] == cached['mtime_ns']:
+        return True
+    return content_hash(path) == cached['sha1']
+
+
+def load(files):
+    """
+    Return the cached data frame for the given source files, or None if
+    there is no valid cache entry
+    """
+    cache_file = _cache_path(files)
+    try:
+        with np.load(cache_file) as npz:
+            meta = json.loads(str(npz['__meta__']))
+            if meta['format'] != CACHE_FORMAT or meta['files'] != list(files):
+                return None
+            if not all(_is_valid(cached, path) for cached, path in zip(meta['sources'], files)):
+                logging.debug(f"Stale parse cache for {files}")
+                return None
+            columns = {}
+            for i, col in enumerate(meta['columns']):
+                values = npz[f"col{i}"]
+                if col in meta['categories']:
+                    values = pd.Categorical.from_codes(values, categories=meta['categories'][col])
+                columns[col] = values
+            df = pd.DataFrame(columns)
+    except FileNotFoundError:
+        return None
+    except Exception as err:
+        logging.warning(f"Ignoring unreadable parse cache {cache_file}: {err}")
+        return None
+
+    logging.debug(f"Loaded {files} from parse cache {cache_file}")
+    return df
+
+
+def save(files, df):
+    """
+    Write the processed data frame of the given source files to the cache
+    """
+    cache_file = _cache_path(files)
+    meta = {
+        'format': CACHE_FORMAT,
+        'files': list(files),
+        'sources': [_source_info(path) for path in files],
+        'columns': list(df.columns),
+        'categories': {},
+    }
+    arrays = {}
+    for i, col in enumerate(df.columns):
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            # categoricals (the fractions) are stored as integer codes of their category list
+            arrays[f"col{i}"] = df[col].cat.codes.to_numpy().astype(np.int32)
+            meta['categories'][col] = [str(c) for c in df[col].cat.categories]
+            continue
+        values = df[col].to_numpy()
+        if values.dtype == object and all(isinstance(v, str) for v in values):
+            values = values.astype(str)
+        arrays[f"col{i}"] = values
+
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(tmp_file, 'wb') as f:
+            np.savez(f, __meta__=json.dumps(meta), **arrays)
+        os.replace(tmp_file, cache_file)
+        logging.debug(f"Saved {files} to parse cache {cache_file}")
+    except Exception as err:
+        logging.warning(f"Failed to write parse cache {cache_file}: {err}")
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-warm the parse cache of all layout entries")
+    parser.add_argument('--layout', default='assets/data/layout.json', help="layout configuration file")
+    parser.add_argument('--cache-dir', default=cache_dir, help="cache directory")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+    # the store uses the imported module, not __main__
+    import parse_cache
+    import sites
+    from data_store import DataStore
+    parse_cache.cache_dir = args.cache_dir
+
+    site_configs, layout_config = sites.load_layout(args.layout)
+    for site in site_configs:
+        store = DataStore(sites.site_layout(layout_config, site))
+        loaded = store.load()
+        logging.info(f"Parse cache of site {site['id']} warmed for {len(loaded)}/{len(store.file_indexes)} "
+                     f"entries in {args.cache_dir}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+Compact response payloads.
+
+Figure arrays are sent as plotly typed arrays ({"dtype", "bdata"} with the
+base64 of the raw values), dates as milliseconds since the epoch so that
+they can be encoded too (plotly date axes accept them). init_app() adds
+weak ETags with 304 revalidation to GET responses and gzip (or brotli, if
+the brotli package is installed) compression of large text responses.
+"""
+import gzip
+import base64
+import functools
+
+import flask
+import numpy as np
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Smallest response body worth compressing, in bytes
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_LEVEL = 6
+
+COMPRESS_MIMETYPES = {
+    'application/json', 'application/javascript', 'text/javascript',
+    'text/html', 'text/css', 'text/plain', 'text/csv',
+}
+
+
+def date_ms(dates):
+    """
+    Dates as float milliseconds since the epoch
+    """
+    return np.asarray(dates, dtype='datetime64[ms]').astype('int64').astype('float64')
+
+
+def typed_array(values):
+    """
+    Plotly typed-array spec of a float array, e.g. for Patch values
+    """
+    values = np.ascontiguousarray(values, dtype='float64')
+    return {'dtype': 'f8', 'bdata': base64.b64encode(values.tobytes()).decode('ascii')}
+
+
+def encode_figure(fig):
+    """
+    Turn the date x values of every trace into epoch milliseconds so that
+    plotly serializes them as typed arrays like the y and error values
+    """
+    for trace in fig.data:
+        if trace.x is not None and np.asarray(trace.x).dtype.kind == 'M':
+            trace.x = date_ms(trace.x)
+    return fig
+
+
+@functools.lru_cache(maxsize=32)
+def _compress_cached(data, encoding):
+    return _compress(data, encoding)
+
+
+def _compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=COMPRESS_LEVEL)
+
+
+def _encoding(request):
+    if brotli is not None and 'br' in request.accept_encodings:
+        return 'br'
+    if 'gzip' in request.accept_encodings:
+        return 'gzip'
+    return None
+
+
+def _after_request(response):
+    request = flask.request
+    if response.status_code != 200 or response.is_streamed or 'Content-Encoding' in response.headers:
+        return response
+    is_text = response.mimetype in COMPRESS_MIMETYPES
+    if not is_text:
+        # images and other binary files are passed through as they are
+        return response
+    if response.direct_passthrough:
+        # files (e.g. assets) are read so that they can be compressed
+        response.direct_passthrough = False
+
+    if request.method == 'GET':
+        response.add_etag(weak=True)
+        response.make_conditional(request)
+        if response.status_code == 304:
+            return response
+
+    encoding = _encoding(request)
+    data = response.get_data()
+    if encoding is None or len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    # GET responses (assets, layout) repeat, callback responses rarely do
+    compressed = (_compress_cached if request.method == 'GET' else _compress)(data, encoding)
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        # the compressed body is a different representation
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_app(server):
+    server.after_request(_after_request)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+import threading
+
+import pandas as pd
+
+import metrics
+
+# Windows (days before the latest date of each series) summarized in the table
+WINDOWS = {'week': 7, 'month': 30}
+
+
+def compute_stats(data_frames):
+    """
+    Compute the windowed statistics of every series and fraction at once.
+
+    Returns one row per (series index, fraction) with the series' latest
+    date, the fraction's value on that date, and for each window in WINDOWS
+    the window start and the count, mean, min and max of the values.
+    """
+    columns = ['series', 'Fraction', 'latest_date', 'latest_value']
+    for name in WINDOWS:
+        columns += [f'{name}_start', f'{name}_count', f'{name}_mean', f'{name}_min', f'{name}_max']
+
+    frames = [df[['Date', 'Fraction', 'Value']].assign(series=idx) for idx, df in data_frames.items() if len(df)]
+    if not frames:
+        return pd.DataFrame(columns=columns)
+
+    df = pd.concat(frames, ignore_index=True)
+    df['latest_date'] = df.groupby('series')['Date'].transform('max')
+    keys = ['series', 'Fraction']
+
+    latest = df[df['Date'] == df['latest_date']].groupby(keys, sort=False, observed=True).agg(
+        latest_date=('latest_date', 'first'),
+        latest_value=('Value', 'last'),
+    )
+    stats = [latest]
+    for name, days in WINDOWS.items():
+        start = df['latest_date'] - pd.Timedelta(days=days)
+        window = df[df['Date'] >= start].assign(start=start).groupby(keys, sort=False, observed=True).agg(**{
+            f'{name}_start': ('start', 'first'),
+            f'{name}_count': ('Value', 'size'),
+            f'{name}_mean': ('Value', 'mean'),
+            f'{name}_min': ('Value', 'min'),
+            f'{name}_max': ('Value', 'max'),
+        })
+        stats.append(window)
+
+    return pd.concat(stats, axis=1).reset_index()[columns]
+
+
+def series_stats(table, idx):
+    """
+    Rows of the statistics table belonging to one series
+    """
+    return table[table['series'] == idx]
+
+
+def to_records(table):
+    """
+    JSON-friendly records of the statistics table
+    """
+    out = table.copy()
+    for col in out.columns:
+        if pd.api.types.is_datetime64_any_dtype(out[col]):
+            out[col] = out[col].dt.strftime('%Y-%m-%d')
+    return out.astype(object).where(out.notna(), None).to_dict(orient='records')
+
+
+class VersionedCache:
+    """
+    Result of compute(data_frames) for the current data version, recomputed
+    only when the version changes (timed as `stage` in the metrics)
+    """
+    def __init__(self, compute=compute_stats, stage='stats'):
+        self.compute = compute
+        self.stage = stage
+        self._cached = (None, None)
+        self._lock = threading.Lock()
+
+    def get(self, data_frames, version):
+        cached_version, table = self._cached
+        if cached_version == version:
+            return table
+        with self._lock:
+            if self._cached[0] != version:
+                with metrics.timer('stage_seconds', stage=self.stage):
+                    self._cached = (version, self.compute(data_frames))
+            return self._cached[1]
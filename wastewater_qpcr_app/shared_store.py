@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+"""
+Memory-mapped snapshots of the processed data frames shared by all workers.
+
+A snapshot ("generation") is a directory with one .npy file per column of
+every entry and a meta.json describing the entries (version, file
+signature, columns). The CURRENT file names the published generation and
+is replaced atomically, so a reader always maps a complete generation.
+Workers map the arrays read-only with np.load(mmap_mode='r'); on a tmpfs
+such as /dev/shm the pages are shared by every process that maps them.
+"""
+import os
+import json
+import time
+import fcntl
+import shutil
+import logging
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+CURRENT = 'CURRENT'
+
+# Generations kept besides the current one (readers may still be opening them)
+KEEP_GENERATIONS = 2
+
+
+def current_generation(directory):
+    try:
+        with open(os.path.join(directory, CURRENT), 'r') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+@contextmanager
+def publish_lock(directory, blocking=True):
+    """
+    Exclusive lock held while a generation is built, yields False if it
+    could not be acquired without blocking
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, '.lock'), 'w') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _write_entry(path, idx, df):
+    columns = {}
+    for i, col in enumerate(df.columns):
+        values = df[col]
+        file_name = f"{idx}-col{i}.npy"
+        if pd.api.types.is_numeric_dtype(values) or pd.api.types.is_datetime64_any_dtype(values):
+            np.save(os.path.join(path, file_name), values.to_numpy())
+            columns[col] = {'file': file_name}
+        else:
+            # strings are stored as integer codes of a category list
+            codes, categories = pd.factorize(values)
+            np.save(os.path.join(path, file_name), codes.astype(np.int32))
+            columns[col] = {'file': file_name, 'categories': [str(c) for c in categories]}
+    return columns
+
+
+def publish(directory, frames, versions, signatures, previous=None):
+    """
+    Write a new generation and make it the current one.
+
+    Entries whose version did not change since the `previous` generation are
+    hard-linked instead of written again. Returns the generation name.
+    """
+    generation = f"gen-{time.time_ns()}-{os.getpid()}"
+    path = os.path.join(directory, generation)
+    os.makedirs(path)
+
+    previous_meta = read_meta(directory, previous) if previous else {'entries': {}}
+    meta = {'entries': {}, 'signatures': {str(idx): sig for idx, sig in signatures.items()}}
+    for idx, df in frames.items():
+        old = previous_meta['entries'].get(str(idx))
+        if old and old['version'] == versions[idx]:
+            for column in old['columns'].values():
+                os.link(os.path.join(directory, previous, column['file']), os.path.join(path, column['file']))
+            columns = old['columns']
+        else:
+            columns = _write_entry(path, idx, df)
+        meta['entries'][str(idx)] = {'version': versions[idx], 'columns': columns}
+
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+    # atomically switch the current generation
+    tmp_file = os.path.join(directory, f"{CURRENT}.{os.getpid()}.tmp")
+    with open(tmp_file, 'w') as f:
+        f.write(generation)
+    os.replace(tmp_file, os.path.join(directory, CURRENT))
+    logging.info(f"Published shared data generation {generation}")
+
+    _cleanup(directory, generation)
+    return generation
+
+
+def _cleanup(directory, generation):
+    generations = sorted(d for d in os.listdir(directory) if d.startswith('gen-') and d != generation)
+    for old in generations[:-KEEP_GENERATIONS] if KEEP_GENERATIONS else generations:
+        # mapped files stay valid after unlinking
+        shutil.rmtree(os.path.join(directory, old), ignore_errors=True)
+
+
+def read_meta(directory, generation):
+    with open(os.path.join(directory, generation, 'meta.json'), 'r') as f:
+        return json.load(f)
+
+
+def open_generation(directory, generation):
+    """
+    Map a generation, returns (frames, versions, signatures)
+    """
+    meta = read_meta(directory, generation)
+    frames, versions = {}, {}
+    for key, entry in meta['entries'].items():
+        columns = {}
+        for col, column in entry['columns'].items():
+            values = np.load(os.path.join(directory, generation, column['file']), mmap_mode='r')
+            if 'categories' in column:
+                values = pd.Categorical.from_codes(values, categories=column['categories'])
+            columns[col] = values
+        frames[int(key)] = pd.DataFrame(columns, copy=False)
+        versions[int(key)] = entry['version']
+
+    signatures = {int(idx): tuple(tuple(s) if s else None for s in sig) for idx, sig in meta['signatures'].items()}
+    return frames, versions, signatures
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+"""
+Sites (sewersheds) served from one deployment.
+
+layout.json is either the list of layout entries of a single site, or
+
+    {"sites": [{"id": "lanl", "name": "LANL", "data_dir": "assets/data"},
+               {"id": "santa-fe", "name": "Santa Fe"}],
+     "series": [...layout entries...]}
+
+The entries are the charts of every site. Their file paths point into
+DATA_DIR; a site reads the files of the same names from its own data_dir,
+by default DATA_DIR/sites/<id>/. An entry whose data file is missing for a
+site is not loaded for it. The first site is the default one.
+
+A site is loaded on first use and kept in a SiteCache, which drops the
+least recently used sites beyond its size. The manifest (manifest.json in
+the parse cache directory, out of the served assets) indexes the sites with
+the fractions, date ranges and versions of their series; it is updated
+whenever a site is loaded or its data changes, and can be rebuilt for all
+sites with
+
+    python sites.py [--layout assets/data/layout.json] [--site lanl ...]
+"""
+import os
+import copy
+import json
+import logging
+import argparse
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import pandas as pd
+
+import parse_cache
+
+DATA_DIR = 'assets/data'
+
+# id of the site of a list layout
+DEFAULT_SITE = 'default'
+
+MANIFEST_FILE = 'manifest.json'
+
+# layout entry keys holding data file paths
+PATH_KEYS = ['plot_data_tsv', 'plot_std_tsv']
+
+
+def load_layout(path):
+    """
+    Return (sites, layout_config) of a layout file, sites as a list of
+    {'id', 'name', 'data_dir'} dicts with the default site first
+    """
+    with open(path, 'r') as file:
+        layout = json.load(file)
+    if isinstance(layout, list):
+        return [{'id': DEFAULT_SITE, 'name': '', 'data_dir': DATA_DIR}], layout
+
+    sites = []
+    for site in layout.get('sites') or [{'id': DEFAULT_SITE}]:
+        sites.append({
+            'id': str(site['id']),
+            'name': site.get('name', site['id']),
+            'data_dir': site.get('data_dir', os.path.join(DATA_DIR, 'sites', str(site['id']))),
+        })
+    ids = [site['id'] for site in sites]
+    if len(set(ids)) != len(ids):
+        raise ValueError(f"Duplicate site ids in {path}: {ids}")
+    return sites, layout.get('series', [])
+
+
+def find(sites, site_id=None):
+    """
+    The site with the given id (the default site for None), or None
+    """
+    if site_id is None:
+        return sites[0]
+    return next((site for site in sites if site['id'] == site_id), None)
+
+
+def site_path(path, site):
+    """
+    Path of a layout data file in a site's data directory
+    """
+    if not path or os.path.normpath(site['data_dir']) == os.path.normpath(DATA_DIR):
+        return path
+    return os.path.join(site['data_dir'], os.path.relpath(path, DATA_DIR))
+
+
+def site_layout(layout_config, site):
+    """
+    Layout entries with the data file paths of a site
+    """
+    config = copy.deepcopy(layout_config)
+    for entry in config:
+        for key in PATH_KEYS:
+            if key in entry:
+                entry[key] = site_path(entry[key], site)
+    return config
+
+
+class SiteCache:
+    """
+    Loaded sites keyed by id, `load(site_id)` is called on the first request
+    of a site. Beyond `maxsize` sites the least recently used one is dropped,
+    except the `pinned` ones. A site is loaded by one thread at a time, the
+    other sites stay available meanwhile.
+    """
+    def __init__(self, load, maxsize=4, pinned=()):
+        self.load = load
+        self.maxsize = maxsize
+        self.pinned = set(pinned)
+        self._sites = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def get(self, site_id):
+        with self._lock:
+            if site_id in self._sites:
+                self._sites.move_to_end(site_id)
+                return self._sites[site_id]
+            loading = self._loading.setdefault(site_id, threading.Lock())
+
+        with loading:
+            with self._lock:
+                if site_id in self._sites:
+                    return self._sites[site_id]
+            value = self.load(site_id)
+            with self._lock:
+                self._sites[site_id] = value
+                self._loading.pop(site_id, None)
+                evictable = [key for key in self._sites if key not in self.pinned and key != site_id]
+                while len(self._sites) > self.maxsize and evictable:
+                    evicted = evictable.pop(0)
+                    del self._sites[evicted]
+                    logging.info(f"Unloaded site {evicted}")
+            return value
+
+    def loaded(self):
+        with self._lock:
+            return list(self._sites)
+
+
+def series_catalog(frames, versions, layout_config):
+    """
+    Fractions, date range, size and version of every loaded entry
+    """
+    series = []
+    for idx, df in sorted(frames.items()):
+        config = layout_config[idx]
+        series.append({
+            'series': idx,
+            'title': config['title'],
+            'pathogen': config['pathogen'],
+            'units': config.get('plot_yaxis_title'),
+            'derived': config.get('derived'),
+            'fractions': [str(f) for f in pd.unique(df['Fraction'])],
+            'start': f"{df['Date'].min():%Y-%m-%d}" if len(df) else None,
+            'end': f"{df['Date'].max():%Y-%m-%d}" if len(df) else None,
+            'rows': len(df),
+            'version': versions.get(idx),
+        })
+    return series
+
+
+def manifest_path():
+    # generated at runtime, so it is kept with the parse cache and not under assets/ (served as is)
+    return os.path.join(parse_cache.cache_dir, MANIFEST_FILE)
+
+
+def read_manifest(path):
+    """
+    The manifest as {'sites': {id: entry}}, empty if missing or unreadable
+    """
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'sites': {}}
+
+
+def update_manifest(path, site, store):
+    """
+    Record the series of a loaded site's store in the manifest. The file is
+    replaced atomically; concurrent updates of different sites may lose one
+    of them until that site is loaded again.
+    """
+    frames, data_version = store.snapshot()
+    versions = {idx: store.version(idx) for idx in frames}
+    manifest = read_manifest(path)
+    entry = manifest.setdefault('sites', {}).get(site['id'], {})
+    if entry.get('data_version') == data_version:
+        return
+    manifest['sites'][site['id']] = {
+        'name': site['name'],
+        'data_version': data_version,
+        'updated': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'series': series_catalog(frames, versions, store.layout_config),
+    }
+    tmp_file = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(tmp_file, 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp_file, path)
+    except OSError as err:
+        logging.warning(f"Failed to write the site manifest {path}: {err}")
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load the sites of a layout and rebuild their manifest")
+    parser.add_argument('--layout', default=os.path.join(DATA_DIR, 'layout.json'), help="layout configuration file")
+    parser.add_argument('--site', action='append', help="site id (repeatable, all sites by default)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+    from data_store import DataStore
+
+    sites, layout_config = load_layout(args.layout)
+    path = manifest_path()
+    for site in sites:
+        if args.site and site['id'] not in args.site:
+            continue
+        # one site at a time, the parse cache is warmed on the way
+        store = DataStore(site_layout(layout_config, site))
+        loaded = store.load()
+        update_manifest(path, site, store)
+        logging.info(f"Site {site['id']}: {len(loaded)}/{len(store.file_indexes)} entries loaded")
+    logging.info(f"Manifest written to {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+"""
+Export the dashboard as a static site for read-only hosting (nginx, CDN).
+
+The site holds the figure JSON and a standalone Plotly HTML page of every
+chart, an index.html with the sidebar trend cards and the charts, and the
+analysis images of the cards. manifest.json records the data version of
+every chart and the content hash of every file: charts whose data did not
+change are not rendered again, and files are only rewritten when their
+content changed, so syncing the site to a CDN uploads the changed files only.
+
+    python static_export.py [--out site] [--watch SECONDS]
+
+With --watch the data store is refreshed and the site updated every
+SECONDS until interrupted.
+"""
+import os
+import sys
+import json
+import html
+import time
+import logging
+import hashlib
+import argparse
+from datetime import datetime
+
+import pytz
+import plotly
+import plotly.io as pio
+import dash_bootstrap_components as dbc
+from dash.development.base_component import Component
+
+# Bump when the exported files change for the same data
+EXPORT_FORMAT = 1
+
+PLOTLY_JS = 'assets/plotly.min.js'
+
+# Static equivalents (tag, class) of the Bootstrap components used by the sidebar cards
+DBC_TAGS = {
+    'Card': ('div', 'card'),
+    'CardBody': ('div', 'card-body'),
+    'CardLink': ('a', 'card-link'),
+    'Badge': ('span', 'badge'),
+    'Row': ('div', 'row'),
+    'Col': ('div', 'col'),
+}
+
+INDEX_TEMPLATE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>{title}</title>
+<link rel="stylesheet" href="{bootstrap}">
+<link rel="stylesheet" href="assets/styles.css">
+<script src="{plotly_js}"></script>
+</head>
+<body>
+<nav class="navbar navbar-dark bg-dark fixed-top container-fluid">
+  <span class="navbar-brand ms-3">LANL Wastewater</span>
+  <select id="pathogen-menu" class="form-select form-select-sm w-auto me-3">{options}</select>
+</nav>
+<div style="{sidebar_style}">
+{cards}
+<div id="update-time-id">Last updated: {updated}</div>
+</div>
+<div style="{content_style}">
+{charts}
+</div>
+<script>
+// draw each chart when it scrolls into view
+const observer = new IntersectionObserver(function(entries) {{
+    entries.forEach(function(entry) {{
+        if (!entry.isIntersecting) return;
+        observer.unobserve(entry.target);
+        fetch(entry.target.dataset.src).then(r => r.json()).then(function(fig) {{
+            Plotly.newPlot(entry.target, fig.data, fig.layout, {{responsive: true}});
+        }});
+    }});
+}}, {{rootMargin: '200px'}});
+document.querySelectorAll('.chart').forEach(el => observer.observe(el));
+
+// show the cards and charts of the selected pathogen
+document.getElementById('pathogen-menu').addEventListener('change', function(e) {{
+    document.querySelectorAll('[data-pathogen]').forEach(function(el) {{
+        const show = e.target.value === 'all pathogens' || el.dataset.pathogen === e.target.value;
+        el.style.display = show ? '' : 'none';
+    }});
+}});
+</script>
+</body>
+</html>
+"""
+
+
+def style_attr(style):
+    """
+    Inline CSS of a Dash style dict (camelCase or kebab-case keys)
+    """
+    def kebab(key):
+        return ''.join(f"-{c.lower()}" if c.isupper() else c for c in key)
+    return '; '.join(f"{kebab(k)}: {v}" for k, v in (style or {}).items())
+
+
+def render_html(node, links=None):
+    """
+    Render a tree of Dash html and Bootstrap components as static HTML.
+    `links` maps component ids to href values (e.g. the card links that open
+    the modal in the app).
+    """
+    links = links or {}
+    if node is None:
+        return ''
+    if isinstance(node, (list, tuple)):
+        return ''.join(render_html(child, links) for child in node)
+    if not isinstance(node, Component):
+        return html.escape(str(node))
+
+    props = node.to_plotly_json()['props']
+    classes = []
+    if node._namespace == 'dash_html_components':
+        tag = node._type.lower()
+    elif node._namespace == 'dash_bootstrap_components' and node._type in DBC_TAGS:
+        tag, cls = DBC_TAGS[node._type]
+        classes.append(cls)
+        if node._type == 'Badge':
+            classes.append(f"bg-{props.get('color', 'secondary')}")
+    else:
+        raise ValueError(f"Cannot render {node._namespace}.{node._type} as static HTML")
+
+    if props.get('className'):
+        classes.append(props['className'])
+    attrs = {'id': props.get('id'), 'class': ' '.join(classes), 'style': style_attr(props.get('style'))}
+    attrs['href'] = links.get(props.get('id'), props.get('href'))
+    attr_text = ''.join(f' {k}="{html.escape(str(v))}"' for k, v in attrs.items() if v)
+    return f"<{tag}{attr_text}>{render_html(props.get('children'), links)}</{tag}>"
+
+
+def content_hash(content):
+    return hashlib.sha1(content if isinstance(content, bytes) else content.encode()).hexdigest()
+
+
+def write_if_changed(path, content):
+    """
+    Write content unless the file already holds it, returns its content hash
+    """
+    data = content if isinstance(content, bytes) else content.encode()
+    digest = content_hash(data)
+    try:
+        with open(path, 'rb') as f:
+            if content_hash(f.read()) == digest:
+                return digest
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_file = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_file, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_file, path)
+    return digest
+
+
+def read_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, 'manifest.json'), 'r') as f:
+            manifest = json.load(f)
+        return manifest if manifest.get('format') == EXPORT_FORMAT else {}
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def export_chart(page, out_dir, idx, version, previous):
+    """
+    Write the figure JSON and Plotly HTML of one chart unless the previous
+    export has the same data version, returns its manifest entry
+    """
+    name = f"chart{idx+1}"
+    files = {'json': f"figures/{name}.json", 'html': f"charts/{name}.html"}
+    if previous.get('version') == version and all(
+            os.path.exists(os.path.join(out_dir, path)) for path in files.values()):
+        return previous
+
+    df, version = page.store.get(idx)
+    fig_json = page.figure_cache.get_json(idx, version, df)
+    chart_html = pio.to_html(json.loads(fig_json), include_plotlyjs=f"../{PLOTLY_JS}", full_html=True,
+                             validate=False, config={'responsive': True})
+    logging.info(f"Exported {name}: {page.layout_config[idx]['title']}")
+    return {
+        'version': version,
+        'title': page.layout_config[idx]['title'],
+        'files': {
+            files['json']: write_if_changed(os.path.join(out_dir, files['json']), fig_json),
+            files['html']: write_if_changed(os.path.join(out_dir, files['html']), chart_html),
+        },
+    }
+
+
+def export(page, out_dir):
+    """
+    Export the current data of the dashboard page module to out_dir,
+    returns the manifest
+    """
+    previous = read_manifest(out_dir)
+    frames, data_version = page.store.snapshot()
+    layout_config = page.layout_config
+
+    files = {}
+    plotly_js = os.path.join(os.path.dirname(plotly.__file__), 'package_data', 'plotly.min.js')
+    for path, source in [(PLOTLY_JS, plotly_js), ('assets/styles.css', 'assets/styles.css')]:
+        with open(source, 'rb') as f:
+            files[path] = write_if_changed(os.path.join(out_dir, path), f.read())
+
+    # charts, only rendered again when their data changed
+    charts = {}
+    for idx in page.chart_indexes:
+        if idx not in frames:
+            continue
+        old = previous.get('charts', {}).get(str(idx), {})
+        charts[str(idx)] = export_chart(page, out_dir, idx, page.store.version(idx), old)
+        files.update(charts[str(idx)]['files'])
+
+    # analysis images opened from the sidebar cards
+    links = {}
+    for idx, config in enumerate(layout_config):
+        image = config.get('analysis', {}).get('figure')
+        if image and os.path.exists(image):
+            path = f"images/{os.path.basename(image)}"
+            with open(image, 'rb') as f:
+                files[path] = write_if_changed(os.path.join(out_dir, path), f.read())
+            links[f"trend-figure-link{idx+1}"] = path
+
+    cards = []
+    for card in page.build_trend_cards(page.get_stats(), page.get_trends(), page.get_events()):
+        idx = int(card.id.replace('trend-card', '')) - 1
+        cards.append(f'<div data-pathogen="{html.escape(layout_config[idx]["pathogen"])}">'
+                     f'{render_html(card, links)}</div>')
+
+    blocks = []
+    for key, chart in charts.items():
+        config = layout_config[int(key)]
+        json_path = next(path for path in chart['files'] if path.endswith('.json'))
+        # the content hash busts CDN caches of changed figures
+        blocks.append(
+            f'<div data-pathogen="{html.escape(config["pathogen"])}" style="{style_attr(page.PLOT_STYLE)}">'
+            f'<h4>{html.escape(config["title"])}</h4><p>{html.escape(config["description"])}</p>'
+            f'<div class="chart" data-src="{json_path}?v={chart["files"][json_path][:12]}" style="height: 700px"></div>'
+            f'</div>'
+        )
+
+    pathogens = list(dict.fromkeys(layout_config[int(key)]['pathogen'] for key in charts))
+    updated = page.store.latest_mtime()
+    index = INDEX_TEMPLATE.format(
+        title="Wastewater qPCR",
+        bootstrap=dbc.themes.BOOTSTRAP,
+        plotly_js=PLOTLY_JS,
+        options=''.join(f'<option>{html.escape(p)}</option>' for p in ['all pathogens'] + pathogens),
+        sidebar_style=style_attr(page.SIDEBAR_STYLE),
+        content_style=style_attr(page.CONTENT_STYLE),
+        cards='\n'.join(cards),
+        updated=(datetime.fromtimestamp(updated, tz=pytz.timezone('America/Denver')).strftime('%Y-%m-%d %H:%M')
+                 if updated else 'Unknown'),
+        charts='\n'.join(blocks),
+    )
+    files['index.html'] = write_if_changed(os.path.join(out_dir, 'index.html'), index)
+
+    # files of charts that are no longer exported
+    for path in set(previous.get('files', {})) - set(files):
+        if os.path.exists(os.path.join(out_dir, path)):
+            os.remove(os.path.join(out_dir, path))
+
+    manifest = {
+        'format': EXPORT_FORMAT,
+        'data_version': data_version,
+        'charts': charts,
+        'files': files,
+    }
+    if {k: v for k, v in previous.items() if k != 'exported_at'} != manifest:
+        manifest['exported_at'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        write_if_changed(os.path.join(out_dir, 'manifest.json'), json.dumps(manifest, indent=2))
+    else:
+        manifest = previous
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the dashboard as a static site")
+    parser.add_argument('--out', default='site', help="output directory")
+    parser.add_argument('--watch', type=float, help="refresh the data and export again every WATCH seconds")
+    args = parser.parse_args()
+
+    # the page module loads layout.json and the data when the app is imported
+    import app  # noqa: F401
+    page = sys.modules['pages.wastewater_qpcr_app']
+
+    while True:
+        manifest = export(page, args.out)
+        logging.info(f"Exported {len(manifest['charts'])} charts (data version {manifest['data_version']}) "
+                     f"to {args.out}")
+        if not args.watch:
+            break
+        time.sleep(args.watch)
+        page.store.refresh(force=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import diskcache
+
+
+class SummaryJobs:
+    """
+    Background AI summary jobs with results cached on (pathogen, data version, model).
+
+    Results and "running" markers are kept in a diskcache.Cache shared by all
+    gunicorn workers. The first request for a key claims it and runs the job
+    in this process' thread pool; identical requests made meanwhile (from any
+    worker) do not start another job and pick up the cached result instead.
+
+    Jobs are called with a `progress(text)` keyword argument to report their
+    partial result (e.g. the tokens streamed so far), which is stored at most
+    every `progress_interval` seconds and readable from any worker with partial().
+    """
+    def __init__(self, directory, max_workers=2, timeout=300, expire=24*3600, error_expire=60,
+                 progress_interval=0.25):
+        self.cache = diskcache.Cache(directory)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ai-summary')
+        self.timeout = timeout
+        self.expire = expire
+        self.error_expire = error_expire
+        self.progress_interval = progress_interval
+
+    @staticmethod
+    def key(pathogen, data_version, model):
+        return f"summary:{model}:{data_version}:{pathogen}"
+
+    def result(self, key):
+        """
+        Return the finished job as {'summary': ...} or {'error': ...}, or None
+        """
+        return self.cache.get(key)
+
+    def partial(self, key):
+        """
+        Partial result reported by the running job, or None
+        """
+        return self.cache.get(f"partial:{key}")
+
+    def is_running(self, key):
+        return f"running:{key}" in self.cache
+
+    def submit(self, key, func, *args):
+        """
+        Start func(*args) for key unless its result is cached or it is already
+        running. Returns the cached result, or None while the job is pending.
+        A cached error is discarded so that the job is retried.
+        """
+        result = self.result(key)
+        if result is not None:
+            if 'error' not in result:
+                return result
+            self.cache.delete(key)
+
+        # add() is atomic across processes, only one claimant runs the job
+        if self.cache.add(f"running:{key}", os.getpid(), expire=self.timeout):
+            logging.info(f"Starting AI summary job {key}")
+            self.executor.submit(self._run, key, func, *args)
+        return None
+
+    def _progress(self, key):
+        last_update = 0
+
+        def progress(text):
+            nonlocal last_update
+            now = time.monotonic()
+            if now - last_update >= self.progress_interval:
+                last_update = now
+                self.cache.set(f"partial:{key}", text, expire=self.timeout)
+        return progress
+
+    def _run(self, key, func, *args):
+        try:
+            self.cache.set(key, {'summary': func(*args, progress=self._progress(key))}, expire=self.expire)
+            logging.info(f"AI summary job {key} finished")
+        except Exception as e:
+            logging.error(f"Error generating AI summary: {e}")
+            self.cache.set(key, {'error': f"Error generating AI summary: {str(e)}"}, expire=self.error_expire)
+        finally:
+            self.cache.delete(f"running:{key}")
+            self.cache.delete(f"partial:{key}")
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+import numpy as np
+import pandas as pd
+
+# Trend windows (days before the latest date of each series), the first one
+# drives the sidebar cards. Layout entries can override them with "trend_windows".
+DEFAULT_WINDOWS = [28, 90]
+
+# Significance level of the Mann-Kendall test
+ALPHA = 0.05
+
+# Minimum number of samples in a window to test for a trend
+MIN_SAMPLES = 4
+
+TREND_COLUMNS = ['series', 'Fraction', 'window_days', 'n', 'trend', 'p', 'tau', 'slope_per_day']
+
+
+def sens_slope(t, y):
+    """
+    Sen's slope (median of the pairwise slopes) for irregularly spaced samples
+    """
+    i, j = np.triu_indices(len(t), 1)
+    dt = t[j] - t[i]
+    valid = dt > 0
+    if not valid.any():
+        return np.nan
+    return float(np.median((y[j][valid] - y[i][valid]) / dt[valid]))
+
+
+def _trend_task(task):
+    """
+    Mann-Kendall test of one (series, fraction, window)
+    """
+    idx, fraction, window, days, values = task
+    row = {'series': idx, 'Fraction': fraction, 'window_days': window, 'n': len(values),
+           'trend': 'insufficient data', 'p': np.nan, 'tau': np.nan, 'slope_per_day': np.nan}
+    if len(values) < MIN_SAMPLES:
+        return row
+
+    # imported on first use, pymannkendall pulls in scipy.stats (slow to import)
+    import pymannkendall as mk
+    result = mk.original_test(values, alpha=ALPHA)
+    row.update(
+        trend='stable' if result.trend == 'no trend' else result.trend,
+        p=float(result.p),
+        tau=float(result.Tau),
+        slope_per_day=sens_slope(days, values),
+    )
+    return row
+
+
+def trend_tasks(data_frames, layout_config):
+    for idx, df in data_frames.items():
+        if not len(df):
+            continue
+        windows = layout_config[idx].get('trend_windows', DEFAULT_WINDOWS)
+        df = df[df['Value'].notna()]
+        latest_date = df['Date'].max()
+        days = ((df['Date'] - latest_date) / pd.Timedelta(days=1)).to_numpy()
+        values = df['Value'].to_numpy(dtype='float64')
+        for fraction, positions in df.groupby('Fraction', sort=False, observed=True).indices.items():
+            for window in windows:
+                in_window = positions[days[positions] >= -window]
+                yield idx, fraction, window, days[in_window], values[in_window]
+
+
+def compute_trends(data_frames, layout_config):
+    """
+    Mann-Kendall trend and Sen's slope of every series, fraction and window.
+
+    Returns one row per (series index, fraction, window) with the number of
+    samples, the trend ('increasing', 'decreasing', 'stable' or
+    'insufficient data'), the p-value, Kendall's tau and the slope per day.
+    Runs serially in the calling thread, once per data version (VersionedCache).
+    """
+    rows = [_trend_task(task) for task in trend_tasks(data_frames, layout_config)]
+    return pd.DataFrame(rows, columns=TREND_COLUMNS)
+
+
+def series_trend(trends, idx, window=None):
+    """
+    Overall trend of a series in one window (the first one by default):
+    the common trend of its fractions, 'mixed' if they disagree
+    """
+    rows = trends[trends['series'] == idx]
+    if window is None and len(rows):
+        window = rows['window_days'].iloc[0]
+    rows = rows[rows['window_days'] == window]
+    found = set(rows['trend']) - {'insufficient data'}
+    if not found:
+        return 'insufficient data', rows
+    if found == {'stable'}:
+        return 'stable', rows
+    found.discard('stable')
+    return (found.pop() if len(found) == 1 else 'mixed'), rows